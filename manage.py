@@ -1,13 +1,28 @@
 # manage.py
 
+import collections
+import csv
+import datetime
+import gzip
+import io
+import json
+import random
+import sys
+import time
 import unittest
 import coverage
 
 from flask_script import Manager
 from flask_migrate import MigrateCommand
 
+from sqlalchemy import func
+
 from project import create_app, db
-from project.api.models import User
+from project.api.models import User, UserCounter, ChangeCounter
+from project.api import compression
+from project.api import serializers
+from project.api import passwords
+from project.api.utils import parse_date
 
 
 COV = coverage.coverage(
@@ -48,7 +63,252 @@ def seed_db():
     """Seeds the database."""
     db.session.add(User(username='michel', email="michel@meta.com", password = 'michelmichel'))
     db.session.add(User(username='augustin', email="augustin@meta.org", password = 'augustinaugustin'))
+    UserCounter.refresh()
+    db.session.commit()
+
+
+FIRST_NAMES = (
+    'michel', 'augustin', 'marie', 'julie', 'thomas', 'camille', 'lucas',
+    'emma', 'hugo', 'lea', 'louis', 'chloe', 'jules', 'manon', 'arthur')
+LAST_NAMES = (
+    'martin', 'bernard', 'dubois', 'durand', 'leroy', 'moreau', 'simon',
+    'laurent', 'lefebvre', 'michel', 'garcia', 'david', 'bertrand')
+DOMAINS = ('gmail.com', 'meta.com', 'example.org', 'outlook.com')
+
+
+@manager.option('-n', '--count', dest='count', type=int, default=1000000)
+@manager.option('--active-ratio', dest='active_ratio', type=float,
+                default=0.95)
+@manager.option('--admin-ratio', dest='admin_ratio', type=float,
+                default=0.01)
+@manager.option('--days', dest='days', type=int, default=730,
+                help='created_at spread over the last DAYS days')
+@manager.option('--batch-size', dest='batch_size', type=int, default=50000)
+@manager.option('--password', dest='password', default='password')
+@manager.option('--seed', dest='seed', type=int, default=None)
+def seed_bulk(count, active_ratio, admin_ratio, days, batch_size, password,
+              seed):
+    """Loads COUNT synthetic users with COPY, for performance work."""
+    rng = random.Random(seed)
+    # one hash for every row, hashing millions would take hours
+    pw_hash = passwords.hash_password(password)
+    # past the current ids, so the usernames and emails stay unique
+    offset = db.session.query(func.coalesce(func.max(User.id), 0)).scalar()
+    now = datetime.datetime.utcnow()
+    spread = days * 86400
+    start = time.perf_counter()
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for batch_start in range(0, count, batch_size):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for i in range(batch_start, min(batch_start + batch_size, count)):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                name = f'{first}.{last}{offset + i + 1}'
+                writer.writerow((
+                    name,
+                    f'{name}@{rng.choice(DOMAINS)}',
+                    pw_hash,
+                    't' if rng.random() < active_ratio else 'f',
+                    't' if rng.random() < admin_ratio else 'f',
+                    (now - datetime.timedelta(
+                        seconds=rng.uniform(0, spread))).isoformat()
+                ))
+            buffer.seek(0)
+            cursor.copy_expert(
+                'COPY users (username, email, password, active, admin, '
+                'created_at) FROM STDIN WITH (FORMAT csv)', buffer)
+            connection.commit()
+            loaded = min(batch_start + batch_size, count)
+            elapsed = time.perf_counter() - start
+            print(f'{loaded:>10} rows  {loaded / elapsed:10.0f} rows/s')
+        cursor.close()
+    finally:
+        connection.close()
+    elapsed = time.perf_counter() - start
+    print(f'loaded {count} users in {elapsed:.1f} s '
+          f'({count / elapsed:.0f} rows/s)')
+    UserCounter.refresh()
+    ChangeCounter.bump(User.__tablename__)
+    db.session.commit()
+    # fresh planner statistics, estimate_count reads reltuples
+    db.session.execute('ANALYZE users')
+    db.session.commit()
+
+
+@manager.option('-f', '--format', dest='export_format', default='csv',
+                help='csv or ndjson')
+@manager.option('-o', '--output', dest='output', default='-',
+                help='file path, - for stdout')
+@manager.option('-z', '--gzip', dest='compress', action='store_true',
+                default=False)
+@manager.option('--since', dest='since', default=None,
+                help='only users created at or after this date')
+@manager.option('--batch-size', dest='batch_size', type=int, default=10000)
+def export_users(export_format, output, compress, since, batch_size):
+    """Streams the users table to CSV or NDJSON, in constant memory."""
+    if export_format not in ('csv', 'ndjson'):
+        print(f'Unknown format: {export_format}', file=sys.stderr)
+        return 1
+    fields = serializers.ADMIN_FIELDS
+    started_at = datetime.datetime.utcnow()
+    # server-side cursor, fetched batch_size rows at a time; no ORDER BY
+    # so a full export is a sequential scan
+    query = db.session.query(
+        *[getattr(User, field) for field in fields]
+    ).execution_options(stream_results=True).yield_per(batch_size)
+    if since:
+        try:
+            query = query.filter(User.created_at >= parse_date(since))
+        except ValueError:
+            print(f'Invalid date: {since}', file=sys.stderr)
+            return 1
+    serialize = serializers.compile_fields(fields)
+    target = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    binary = gzip.GzipFile(fileobj=target, mode='wb') if compress else target
+    stream = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    start = time.perf_counter()
+    count = 0
+    try:
+        if export_format == 'csv':
+            writer = csv.writer(stream)
+            writer.writerow(fields)
+            for row in query:
+                writer.writerow(serialize(row).values())
+                count += 1
+        else:
+            for row in query:
+                stream.write(serializers.dumps(serialize(row)) + '\n')
+                count += 1
+    finally:
+        stream.detach()
+        if compress:
+            # writes the gzip trailer, leaves the target open
+            binary.close()
+        if output == '-':
+            target.flush()
+        else:
+            target.close()
+    elapsed = time.perf_counter() - start
+    print(f'exported {count} users in {elapsed:.1f} s '
+          f'({count / elapsed:.0f} rows/s)', file=sys.stderr)
+    print(f'next incremental export: --since '
+          f'{started_at.strftime("%Y-%m-%dT%H:%M:%S.%f")}', file=sys.stderr)
+
+
+@manager.option('-n', '--count', dest='count', type=int, default=10000)
+def benchmark_compression(count):
+    """Benchmarks response compression per level on a users payload."""
+    created_at = datetime.datetime.utcnow()
+    payload = app.json_encoder().encode({
+        'status': 'success',
+        'data': {
+            'users': [{
+                'id': i,
+                'username': f'user{i}',
+                'email': f'user{i}@example.com',
+                'created_at': created_at - datetime.timedelta(minutes=i)
+            } for i in range(count)]
+        }
+    }).encode()
+    print(f'payload: {len(payload)} bytes, {count} users')
+    print('encoding  level       bytes   ratio      ms     MB/s')
+    levels = [('gzip', level) for level in range(1, 10)]
+    if compression.brotli is not None:
+        levels += [('br', level) for level in range(0, 12)]
+    for encoding, level in levels:
+        start = time.perf_counter()
+        size = len(compression.compress(payload, encoding, level))
+        elapsed = time.perf_counter() - start
+        print(f'{encoding:8}  {level:5}  {size:10}  {size / len(payload):6.3f}'
+              f'  {elapsed * 1000:6.1f}  {len(payload) / elapsed / 1e6:7.1f}')
+
+
+@manager.option('-n', '--count', dest='count', type=int, default=10000)
+@manager.option('-r', '--repeat', dest='repeat', type=int, default=5)
+def benchmark_serializer(count, repeat):
+    """Benchmarks the users list serialization against plain jsonify."""
+    Row = collections.namedtuple('Row', serializers.PUBLIC_FIELDS)
+    created_at = datetime.datetime.utcnow()
+    rows = [
+        Row(i, f'user{i}', f'user{i}@example.com',
+            created_at - datetime.timedelta(minutes=i))
+        for i in range(count)
+    ]
+
+    def legacy():
+        # hand-built dicts, encoded the way jsonify does
+        users = [{
+            'id': row.id,
+            'username': row.username,
+            'email': row.email,
+            'created_at': row.created_at
+        } for row in rows]
+        return json.dumps(
+            {'status': 'success', 'data': {'users': users}},
+            cls=app.json_encoder, indent=2, separators=(', ', ': '))
+
+    def serializer():
+        return serializers.dumps({
+            'status': 'success',
+            'data': {'users': serializers.serialize_users(rows)}
+        })
+
+    backend = 'orjson' if serializers.orjson is not None else 'json'
+    print(f'{count} users, best of {repeat}, backend: {backend}')
+    timings = {}
+    for name, function in [('jsonify', legacy), ('serializer', serializer)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+        print(f'{name:12}{best * 1000:8.1f} ms')
+    print(f'speedup: {timings["jsonify"] / timings["serializer"]:.1f}x')
+
+
+@manager.option('-t', '--target-ms', dest='target_ms', type=float,
+                default=250)
+@manager.option('--hasher', dest='hasher', default=None,
+                help='bcrypt, scrypt or argon2 (default: PASSWORD_HASHER)')
+def calibrate_hashing(target_ms, hasher):
+    """Recommends a password hashing cost for a target latency."""
+    config = app.config
+    name = hasher or config['PASSWORD_HASHER']
+    if name == 'bcrypt':
+        key, costs = 'BCRYPT_LOG_ROUNDS', range(4, 20)
+    elif name == 'scrypt':
+        key = 'SCRYPT_LOG_N'
+        costs = [(log_n, config['SCRYPT_R'], config['SCRYPT_P'])
+                 for log_n in range(10, 22)]
+    elif name == 'argon2':
+        key = 'ARGON2_TIME_COST'
+        costs = [(time_cost, config['ARGON2_MEMORY_COST'],
+                  config['ARGON2_PARALLELISM'])
+                 for time_cost in range(1, 11)]
+    else:
+        print(f'Unknown hasher: {name}')
+        return 1
+    best, timings = passwords.calibrate(
+        passwords.HASHERS[name], costs, target_ms / 1000)
+    for cost, elapsed in timings:
+        cost = cost[0] if isinstance(cost, tuple) else cost
+        print(f'{key} = {cost:2}: {elapsed * 1000:8.1f} ms')
+    if best is None:
+        print(f'Even the lowest cost is above {target_ms} ms.')
+        return 1
+    best = best[0] if isinstance(best, tuple) else best
+    print(f'Recommended for {target_ms} ms: {key} = {best}')
+
+
+@manager.command
+def refresh_user_stats():
+    """Recomputes the user counters from the users table."""
+    UserCounter.refresh()
     db.session.commit()
+    print(UserCounter.get_all())
 
 
 @manager.command
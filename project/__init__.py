@@ -7,12 +7,35 @@ from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 
+from project.api.cache import LRUCache
+from project.api.hashing import HashingPool
+from project.api.ratelimit import RateLimiter
+from project.api.revocation import RevocationFilter
+from project.api.keys import KeyRing
+from project.api.audit import AuditLog
+
 # instantiate the db
 db = SQLAlchemy()
 # instantiate flask migrate
 migrate = Migrate()
 # instantiate flask bcrypt
 bcrypt = Bcrypt()
+# instantiate the user records cache
+user_cache = LRUCache('USER_CACHE')
+# instantiate the verified tokens cache
+token_cache = LRUCache('TOKEN_CACHE')
+# instantiate the token versions cache
+token_version_cache = LRUCache('TOKEN_VERSION_CACHE')
+# instantiate the password hashing pool
+hashing_pool = HashingPool('HASHING_POOL')
+# instantiate the rate limiter
+limiter = RateLimiter()
+# instantiate the token revocation filter
+revocation = RevocationFilter()
+# instantiate the JWT signing keys
+keyring = KeyRing()
+# instantiate the login audit log
+audit = AuditLog()
 
 
 def create_app():
@@ -31,11 +54,36 @@ def create_app():
     db.init_app(app)
     bcrypt.init_app(app)
     migrate.init_app(app, db)
+    user_cache.init_app(app)
+    token_cache.init_app(app)
+    token_version_cache.init_app(app)
+    hashing_pool.init_app(app)
+    limiter.init_app(app)
+    keyring.init_app(app)
+
+    from project.api.models import RevokedToken, LoginEvent
+    revocation.init_app(app, RevokedToken)
+    audit.init_app(app, LoginEvent)
 
     # register blueprints
     from project.api.users import users_blueprint
     from project.api.auth import auth_blueprint
+    from project.api.metrics import metrics_blueprint, register_metrics
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(users_blueprint)
+    app.register_blueprint(metrics_blueprint)
+
+    # compress responses
+    from project.api.compression import compress_response
+    app.after_request(compress_response)
+
+    # expose counters
+    register_metrics('user_cache', user_cache.stats)
+    register_metrics('token_cache', token_cache.stats)
+    register_metrics('token_version_cache', token_version_cache.stats)
+    register_metrics('hashing_pool', hashing_pool.stats)
+    register_metrics('ratelimit', limiter.stats)
+    register_metrics('revocation', revocation.stats)
+    register_metrics('audit', audit.stats)
 
     return app
@@ -0,0 +1,158 @@
+# project/api/audit.py
+
+
+import atexit
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+
+
+logger = logging.getLogger(__name__)
+
+# queued by flush() and close() to wake the writer up
+WAKE = object()
+
+
+class AuditLog:
+    """Login events, written off the request thread in batches
+
+    record() only puts the event on a bounded queue; a background thread
+    writes AUDIT_BATCH_SIZE events per multi-row INSERT, or whatever is
+    queued after AUDIT_FLUSH_INTERVAL seconds, and drains the queue at
+    shutdown; events are only ever written from that thread, with the
+    app that recorded them. When the queue is full AUDIT_FULL_POLICY
+    either drops the event ('drop') or blocks the request for up to
+    AUDIT_BLOCK_TIMEOUT seconds ('block').
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.policy = 'drop'
+        self.block_timeout = 1.0
+        self.queue = queue.Queue(10000)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._registered = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def init_app(self, app, store):
+        app.extensions['audit'] = store
+        self.enabled = app.config.get('AUDIT_ENABLED', self.enabled)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get(
+            'AUDIT_FLUSH_INTERVAL', self.flush_interval)
+        self.policy = app.config.get('AUDIT_FULL_POLICY', self.policy)
+        self.block_timeout = app.config.get(
+            'AUDIT_BLOCK_TIMEOUT', self.block_timeout)
+        with self._lock:
+            if self._registered:
+                return
+            # the first app sizes the queue, later ones share it
+            self.queue = queue.Queue(
+                app.config.get('AUDIT_QUEUE_SIZE', 10000))
+            atexit.register(self.close)
+            self._registered = True
+
+    def record(self, **event):
+        """Queues an event, never waits on the database"""
+        if not self.enabled:
+            return
+        item = (current_app._get_current_object(), event)
+        try:
+            if self.policy == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        self.start()
+
+    def start(self):
+        # started lazily, and again in a forked worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def run(self):
+        while not self._stop.is_set():
+            batch = self.take(self.flush_interval)
+            if batch:
+                self.write(batch)
+
+    def take(self, timeout):
+        """Waits up to `timeout` for a batch, less if woken - :return: list"""
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                break
+            if item is WAKE:
+                self.queue.task_done()
+                break
+            batch.append(item)
+        return batch
+
+    def write(self, batch):
+        # one INSERT per app, only the tests run more than one
+        for app, items in itertools.groupby(batch, key=lambda item: item[0]):
+            events = [event for _, event in items]
+            try:
+                with app.app_context():
+                    app.extensions['audit'].write(events)
+                with self._lock:
+                    self.written += len(events)
+            except Exception:
+                logger.exception(
+                    'Could not write %d audit events.', len(events))
+                with self._lock:
+                    self.failed += len(events)
+            finally:
+                for _ in events:
+                    self.queue.task_done()
+
+    def flush(self):
+        """Wakes the writer and waits until everything queued is written"""
+        self.start()
+        self.queue.put(WAKE)
+        self.queue.join()
+
+    def close(self):
+        """Drains the queue, then stops the writer"""
+        if self._pid != os.getpid() and self.queue.empty():
+            return
+        self.flush()
+        self._stop.set()
+        self.queue.put(WAKE)
+        self._thread.join(self.flush_interval + 5)
+        self._pid = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed
+            }
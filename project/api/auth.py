@@ -1,18 +1,26 @@
 # project/api/auth.py
 
 
-from flask import Blueprint, jsonify, request
-from sqlalchemy import exc, or_
+import datetime
+
+from flask import Blueprint, jsonify, request, g, current_app
+from sqlalchemy import exc
 
 from project.api.models import User
-from project import db, bcrypt
-from project.api.utils import authenticate
+from project import db, user_cache, limiter, revocation, keyring, audit
+from project.api.utils import authenticate, parse_fields, load_user
+from project.api.utils import decode_auth_token, user_columns
+from project.api.hashing import PoolFull
+from project.api.passwords import verify_password, needs_rehash
+from project.api.passwords import hash_password
+from project.api.serializers import SELF_FIELDS, serialize_user, json_response
 
 
 auth_blueprint = Blueprint('auth', __name__)
 
 
 @auth_blueprint.route('/auth/register', methods=['POST'])
+@limiter.limit('register')
 def register_user():
     # get post data
     post_data = request.get_json()
@@ -25,33 +33,35 @@ def register_user():
     username = post_data.get('username')
     email = post_data.get('email')
     password = post_data.get('password')
+    if not all(isinstance(value, str) and value
+               for value in (username, email, password)):
+        response_object = {
+            'status': 'error',
+            'message': 'Invalid payload.'
+        }
+        return jsonify(response_object), 400
     try:
-        # check for existing user
-        user = User.query.filter(
-            or_(User.username == username, User.email == email)).first()
-        if not user:
-            # add new user to db
-            new_user = User(
-                username=username,
-                email=email,
-                password=password
-            )
-            db.session.add(new_user)
-            db.session.commit()
-            # generate auth token
-            auth_token = new_user.encode_auth_token(new_user.id)
-            response_object = {
-                'status': 'success',
-                'message': 'Successfully registered.',
-                'auth_token': auth_token.decode()
-            }
-            return jsonify(response_object), 201
-        else:
+        # add new user to db, unless the username or email is taken
+        new_user, conflict = User.create(username, email, password)
+        if conflict:
+            db.session.rollback()
             response_object = {
                 'status': 'error',
-                'message': 'Sorry. That user already exists.'
+                'message': 'Sorry. That user already exists.',
+                'conflict': conflict
             }
             return jsonify(response_object), 400
+        db.session.commit()
+        # drop a negative entry cached for the new id
+        user_cache.invalidate(new_user.id)
+        # generate auth token, the returned row has the claim columns
+        auth_token = User.encode_auth_token(new_user, new_user.id)
+        response_object = {
+            'status': 'success',
+            'message': 'Successfully registered.',
+            'auth_token': auth_token.decode()
+        }
+        return jsonify(response_object), 201
     # handler errors
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
@@ -63,6 +73,7 @@ def register_user():
 
 
 @auth_blueprint.route('/auth/login', methods=['POST'])
+@limiter.limit('login')
 def login_user():
     # get post data
     post_data = request.get_json()
@@ -77,7 +88,10 @@ def login_user():
     try:
         # fetch the user data
         user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and verify_password(user.password, password):
+            record_login(user.id, 'success')
+            if needs_rehash(user.password):
+                rehash_password(user, password)
             auth_token = user.encode_auth_token(user.id)
             if auth_token:
                 response_object = {
@@ -87,11 +101,14 @@ def login_user():
                 }
                 return jsonify(response_object), 200
         else:
+            record_login(user.id if user else None, 'failure')
             response_object = {
                 'status': 'error',
                 'message': 'User does not exist.'
             }
             return jsonify(response_object), 404
+    except PoolFull:
+        raise
     except Exception as e:
         print(e)
         response_object = {
@@ -101,9 +118,35 @@ def login_user():
         return jsonify(response_object), 500
 
 
+def record_login(user_id, outcome):
+    """Queues the login event, written in the background"""
+    audit.record(
+        user_id=user_id,
+        ip=request.remote_addr,
+        outcome=outcome,
+        created_at=datetime.datetime.utcnow()
+    )
+
+
+def rehash_password(user, password):
+    """Upgrades a hash made with an old algorithm or cost"""
+    try:
+        user.password = hash_password(password)
+        db.session.commit()
+    except PoolFull:
+        # not worth failing the login, next one will retry
+        db.session.rollback()
+
+
 @auth_blueprint.route('/auth/logout', methods=['GET'])
 @authenticate
-def logout_user(resp):
+def logout_user(user):
+    payload = g.token_payload
+    if payload.get('jti'):
+        revocation.revoke(
+            payload['jti'],
+            datetime.datetime.utcfromtimestamp(payload['exp']))
+        db.session.commit()
     response_object = {
         'status': 'success',
         'message': 'Successfully logged out.'
@@ -111,18 +154,113 @@ def logout_user(resp):
     return jsonify(response_object), 200
 
 
+@auth_blueprint.route('/auth/jwks', methods=['GET'])
+def get_jwks():
+    """Public keys verifying the tokens (empty with HS256)"""
+    algorithm = current_app.config.get('JWT_ALGORITHM')
+    if algorithm.startswith('HS'):
+        jwks = {'keys': []}
+    else:
+        jwks = keyring.jwks(algorithm)
+    response = json_response(jwks, 200)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get(
+        'JWKS_CACHE_MAX_AGE')
+    return response
+
+
+@auth_blueprint.route('/auth/introspect', methods=['POST'])
+def introspect_tokens():
+    """Validates a batch of tokens, their users loaded in one query
+
+    Takes `{"tokens": [...]}`, answers one `status`/`message` or
+    `status`/`data` object per token, in order.
+    """
+    post_data = request.get_json(silent=True)
+    tokens = post_data.get('tokens') if isinstance(post_data, dict) else None
+    if not isinstance(tokens, list) or \
+            not all(isinstance(token, str) for token in tokens) or \
+            len(tokens) > current_app.config.get('AUTH_INTROSPECT_MAX_TOKENS'):
+        response_object = {
+            'status': 'error',
+            'message': 'Invalid payload.'
+        }
+        return jsonify(response_object), 400
+    try:
+        fields = parse_fields(SELF_FIELDS)
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid fields.'
+        }
+        return jsonify(response_object), 400
+    payloads = []
+    for token in tokens:
+        payload = decode_auth_token(token)
+        if not isinstance(payload, str) and \
+                revocation.is_revoked(payload.get('jti')):
+            payload = 'Token revoked. Please log in again.'
+        payloads.append(payload)
+    user_ids = {
+        payload['sub'] for payload in payloads
+        if not isinstance(payload, str)
+    }
+    users = {}
+    if user_ids:
+        users = {
+            row.id: row for row in db.session.query(
+                *user_columns(fields, 'id', 'active', 'token_version')
+            ).filter(User.id.in_(user_ids))
+        }
+    results = []
+    for payload in payloads:
+        if isinstance(payload, str):
+            results.append({'status': 'error', 'message': payload})
+            continue
+        user = users.get(payload['sub'])
+        if not user or not user.active:
+            results.append({
+                'status': 'error',
+                'message': 'Something went wrong. Please contact us.'
+            })
+        elif payload.get('ver', user.token_version) != user.token_version:
+            results.append({
+                'status': 'error',
+                'message': 'Token revoked. Please log in again.'
+            })
+        else:
+            results.append({
+                'status': 'success',
+                'data': serialize_user(user, fields)
+            })
+    response_object = {
+        'status': 'success',
+        'data': results
+    }
+    return json_response(response_object, 200)
+
+
 @auth_blueprint.route('/auth/status', methods=['GET'])
 @authenticate
-def get_user_status(resp):
-    user = User.query.filter_by(id=resp).first()
+def get_user_status(user):
+    try:
+        fields = parse_fields(SELF_FIELDS)
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid fields.'
+        }
+        return jsonify(response_object), 400
+    # the token only carries the claims
+    user = load_user(user['id'])
+    if not user:
+        response_object = {
+            'status': 'error',
+            'message': 'Something went wrong. Please contact us.'
+        }
+        return jsonify(response_object), 401
     response_object = {
         'status': 'success',
-        'data': {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'active': user.active,
-            'created_at': user.created_at
-        }
+        'data': serialize_user(user, fields)
     }
-    return jsonify(response_object), 200
+    return json_response(response_object, 200)
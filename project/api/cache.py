@@ -0,0 +1,99 @@
+# project/api/cache.py
+
+
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU cache with a TTL per entry
+
+    Configured from the app config with `<prefix>_SIZE`, `<prefix>_TTL`
+    and `<prefix>_NEGATIVE_TTL`; a size of 0 disables the cache.
+    `None` values are negative entries and use the negative TTL.
+    A read-through fill passes the `generation` it started at to set(),
+    which drops it when an invalidation happened meanwhile: the value
+    may predate the write that invalidated it.
+    """
+
+    def __init__(self, config_prefix, maxsize=1024, ttl=60, negative_ttl=5,
+                 clock=time.monotonic):
+        self.config_prefix = config_prefix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        self.maxsize = app.config.get(f'{prefix}_SIZE', self.maxsize)
+        self.ttl = app.config.get(f'{prefix}_TTL', self.ttl)
+        self.negative_ttl = app.config.get(
+            f'{prefix}_NEGATIVE_TTL', self.negative_ttl)
+        self.clear()
+
+    def get(self, key, default=MISSING):
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    @property
+    def generation(self):
+        """Bumped by every invalidation - read it before loading a value"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl=None, generation=None):
+        if self.maxsize <= 0:
+            return
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        expires = self.clock() + ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
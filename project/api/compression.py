@@ -0,0 +1,108 @@
+# project/api/compression.py
+
+
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# content codings this service can produce, by order of preference
+ENCODINGS = ('br', 'gzip')
+COMPRESSIBLE_MIMETYPES = (
+    'application/json', 'application/x-ndjson', 'text/csv', 'text/html')
+
+
+def negotiate_encoding(accept_encodings):
+    """Picks the best supported coding - :return: string|None"""
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level, flush_size):
+    """Compresses a streamed body chunk by chunk, in bounded memory
+
+    The compressor is flushed after the first chunk and then every
+    `flush_size` bytes of input, so the client can decode the rows as
+    they come instead of once the compressor's window is full.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        process, finish = compressor.process, compressor.finish
+
+        def flush():
+            return compressor.flush()
+    else:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+
+        def flush():
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+    # bytes taken since the last flush, the first chunk goes out at once
+    pending = flush_size
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = process(chunk)
+        pending += len(chunk)
+        if pending >= flush_size:
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+
+def compression_level(encoding):
+    if encoding == 'br':
+        return current_app.config.get('COMPRESSION_BROTLI_LEVEL')
+    return current_app.config.get('COMPRESSION_GZIP_LEVEL')
+
+
+def compress_response(response):
+    """after_request hook, compresses the body per Accept-Encoding"""
+    if not current_app.config.get('COMPRESSION_ENABLED') or \
+            response.status_code != 200 or \
+            response.direct_passthrough or \
+            'Content-Encoding' in response.headers or \
+            response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    level = compression_level(encoding)
+    if response.is_streamed:
+        response.response = compress_stream(
+            response.response, encoding, level,
+            current_app.config.get('COMPRESSION_STREAM_FLUSH_SIZE'))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config.get('COMPRESSION_MIN_SIZE'):
+            return response
+        response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    # a strong ETag must differ between codings of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
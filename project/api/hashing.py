@@ -0,0 +1,132 @@
+# project/api/hashing.py
+
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import jsonify
+
+
+class PoolFull(Exception):
+    """Raised when the hashing queue is full, mapped to a 503"""
+
+
+class PoolTimeout(PoolFull):
+    """Raised when a call waited longer than `<prefix>_TIMEOUT`, a 503 too"""
+
+
+class HashingPool:
+    """Bounded thread pool running the bcrypt hashes off the request thread
+
+    bcrypt releases the GIL, so `<prefix>_WORKERS` threads hash in
+    parallel while at most `<prefix>_QUEUE_SIZE` more calls wait; past
+    that, submit() fails fast with PoolFull instead of piling up.
+    """
+
+    def __init__(self, config_prefix, workers=2, queue_size=16, timeout=30):
+        self.config_prefix = config_prefix
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.started = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        self.workers = app.config.get(f'{prefix}_WORKERS', self.workers)
+        self.queue_size = app.config.get(
+            f'{prefix}_QUEUE_SIZE', self.queue_size)
+        self.timeout = app.config.get(f'{prefix}_TIMEOUT', self.timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        app.register_error_handler(PoolFull, self.handle_pool_full)
+
+    def submit(self, function, *args):
+        """Runs `function` on the pool and waits for its result"""
+        return self.result(self.enqueue(function, *args))
+
+    def map(self, function, items):
+        """Runs `function` over `items`, at most `workers` at a time
+
+        Bulk callers keep the queue free for the interactive requests.
+        :return: list of the results, in order
+        """
+        results = []
+        window = collections.deque()
+        for item in items:
+            if len(window) >= self.workers:
+                results.append(self.result(window.popleft()))
+            window.append(self.enqueue(function, item))
+        while window:
+            results.append(self.result(window.popleft()))
+        return results
+
+    def enqueue(self, function, *args):
+        """Queues `function` - :return: future - raise PoolFull"""
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise PoolFull()
+            self.pending += 1
+        queued_at = time.perf_counter()
+
+        def run():
+            wait = time.perf_counter() - queued_at
+            with self._lock:
+                self.started += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                return function(*args)
+            finally:
+                with self._lock:
+                    self.pending -= 1
+                    self.completed += 1
+        return self._executor.submit(run)
+
+    def result(self, future):
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # still queued: drop it, a running hash is left to finish
+            cancelled = future.cancel()
+            with self._lock:
+                self.timeouts += 1
+                if cancelled:
+                    self.pending -= 1
+            raise PoolTimeout()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queue_depth': max(self.pending - self.workers, 0),
+                'pending': self.pending,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'completed': self.completed,
+                'avg_wait_ms': self.total_wait / self.started * 1000
+                if self.started else 0.0,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+    def handle_pool_full(self, error):
+        response_object = {
+            'status': 'error',
+            'message': 'Server busy. Please try again.'
+        }
+        response = jsonify(response_object)
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
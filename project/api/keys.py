@@ -0,0 +1,51 @@
+# project/api/keys.py
+
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key)
+
+from project.api.verifier import jwk_from_public_key
+
+
+class KeyRing:
+    """Private keys of the asymmetric JWT algorithms (RS256, ES256, EdDSA)
+
+    JWT_PRIVATE_KEYS maps a `kid` to a PEM string or a PEM file path.
+    Tokens are signed with JWT_ACTIVE_KID; the other keys still verify
+    the tokens they signed, until those expire (rotation).
+    """
+
+    def __init__(self):
+        self.private_keys = {}
+        self.active_kid = None
+
+    def init_app(self, app):
+        self.private_keys = {
+            kid: self.load(pem)
+            for kid, pem in (app.config.get('JWT_PRIVATE_KEYS') or {}).items()
+        }
+        self.active_kid = app.config.get('JWT_ACTIVE_KID')
+
+    @staticmethod
+    def load(pem):
+        if not pem.lstrip().startswith('-----BEGIN'):
+            with open(pem) as key_file:
+                pem = key_file.read()
+        return load_pem_private_key(pem.encode(), None, default_backend())
+
+    def signing_key(self):
+        """:return: (kid, private key)"""
+        return self.active_kid, self.private_keys[self.active_kid]
+
+    def public_key(self, kid):
+        private_key = self.private_keys.get(kid)
+        return private_key.public_key() if private_key else None
+
+    def jwks(self, algorithm):
+        return {
+            'keys': [
+                jwk_from_public_key(private_key.public_key(), kid, algorithm)
+                for kid, private_key in self.private_keys.items()
+            ]
+        }
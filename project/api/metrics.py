@@ -0,0 +1,23 @@
+# project/api/metrics.py
+
+
+from flask import Blueprint, jsonify
+
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+# name -> callable returning a dict of counters
+sources = {}
+
+
+def register_metrics(name, source):
+    sources[name] = source
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    response_object = {
+        'status': 'success',
+        'data': {name: source() for name, source in sources.items()}
+    }
+    return jsonify(response_object), 200
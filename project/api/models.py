@@ -2,15 +2,27 @@
 
 
 import datetime
+import uuid
 import jwt
+from sqlalchemy import func, exists, or_, any_, bindparam
+from sqlalchemy.dialects.postgresql import insert, ARRAY
 
-from project import db
-from project import db, bcrypt
+from project import db, keyring
+from project.api.passwords import hash_password
 from flask import current_app
 
 
 class User(db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        # keyset pagination key for GET /users
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+        # filtered listings, only the rare rows are indexed
+        db.Index('ix_users_inactive_created_at_id', 'created_at', 'id',
+                 postgresql_where=db.text('NOT active')),
+        db.Index('ix_users_admin_created_at_id', 'created_at', 'id',
+                 postgresql_where=db.text('admin')),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     username = db.Column(db.String(128), unique=True, nullable=False)
     email = db.Column(db.String(128), unique=True, nullable=False)
@@ -18,13 +30,14 @@ class User(db.Model):
     active = db.Column(db.Boolean(), default=True, nullable=False)
     admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
+    # carried by the tokens, bumped to invalidate the ones already issued
+    token_version = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
 
     def __init__(self, username, email, password, created_at=datetime.datetime.utcnow()):
         self.username = username
         self.email = email
-        self.password = bcrypt.generate_password_hash(
-            password, current_app.config.get('BCRYPT_LOG_ROUNDS')
-        ).decode()
+        self.password = hash_password(password)
         self.created_at = created_at
 
     def encode_auth_token(self, user_id):
@@ -36,24 +49,338 @@ class User(db.Model):
                     seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')
                 ),
                 'iat': datetime.datetime.utcnow(),
-                'sub': user_id
+                'sub': user_id,
+                'jti': uuid.uuid4().hex,
+                # authorization claims, trusted while `ver` is current
+                'admin': bool(self.admin),
+                'active': self.active is not False,
+                'ver': self.token_version or 0
             }
+            algorithm = current_app.config.get('JWT_ALGORITHM')
+            if algorithm.startswith('HS'):
+                return jwt.encode(
+                    payload,
+                    current_app.config.get('SECRET_KEY'),
+                    algorithm=algorithm
+                )
+            kid, private_key = keyring.signing_key()
             return jwt.encode(
                 payload,
-                current_app.config.get('SECRET_KEY'),
-                algorithm='HS256'
+                private_key,
+                algorithm=algorithm,
+                headers={'kid': kid}
             )
         except Exception as e:
             return e
 
+    @staticmethod
+    def create(username, email, password):
+        """Inserts a user with one INSERT ... ON CONFLICT DO NOTHING RETURNING
+
+        The password is only hashed once a cheap check found no conflict,
+        the counters are updated - the caller commits.
+        :return: (inserted row, None) or (None, conflicting column)
+        """
+        conflict = User.conflict(username, email)
+        if conflict:
+            return None, conflict
+        inserted = User.insert_many([{
+            'username': username,
+            'email': email,
+            'password': hash_password(password),
+            'created_at': datetime.datetime.utcnow()
+        }])
+        if not inserted:
+            # lost a race with a concurrent signup
+            return None, User.conflict(username, email) or 'email'
+        ChangeCounter.bump(User.__tablename__)
+        UserCounter.record_signups(inserted)
+        return inserted[0], None
+
+    @staticmethod
+    def conflict(username, email):
+        """:return: 'email', 'username' (taken by another user) or None"""
+        email_taken, username_taken = db.session.query(
+            exists().where(User.email == email),
+            exists().where(User.username == username)
+        ).one()
+        if email_taken:
+            return 'email'
+        if username_taken:
+            return 'username'
+        return None
+
+    @staticmethod
+    def insert_many(rows):
+        """Inserts `rows` (column dicts) in one statement
+
+        Rows conflicting on username or email are skipped.
+        :return: the inserted rows (id, username, email, active, admin,
+        created_at, token_version)
+        """
+        table = User.__table__
+        return db.session.execute(
+            insert(table).values(rows).on_conflict_do_nothing().returning(
+                table.c.id, table.c.username, table.c.email,
+                table.c.active, table.c.admin, table.c.created_at,
+                table.c.token_version)
+        ).fetchall()
+
+    @staticmethod
+    def id_in(user_ids):
+        """`id = ANY(:ids)` - one array parameter whatever the count"""
+        return User.id == any_(
+            bindparam('user_ids', list(user_ids), type_=ARRAY(db.Integer),
+                      unique=True))
+
+    @staticmethod
+    def set_flags(criteria, values):
+        """Sets `values` ({'active'|'admin': bool}) on the matching users
+
+        One UPDATE ... FROM (SELECT ... FOR UPDATE) writing only the rows
+        that change, returning their previous flags: the change counter
+        is bumped, the user counters adjusted and the tokens of those users
+        invalidated (token_version) - the caller commits.
+        :return: ids of the changed users
+        """
+        table = User.__table__
+        old = db.session.query(
+            User.id, User.active, User.admin
+        ).filter(
+            *criteria
+        ).filter(
+            or_(*[getattr(User, name).is_distinct_from(value)
+                  for name, value in values.items()])
+        ).with_for_update().subquery('old')
+        rows = db.session.execute(
+            table.update().where(
+                table.c.id == old.c.id
+            ).values(
+                token_version=table.c.token_version + 1, **values
+            ).returning(table.c.id, old.c.active, old.c.admin)
+        ).fetchall()
+        if not rows:
+            return []
+        # counter locks in the order of the insert paths: change_counters,
+        # then user_counters - the other way round they can deadlock
+        ChangeCounter.bump(User.__tablename__)
+        deltas = {}
+        for name, value in values.items():
+            changed = sum(getattr(row, name) != value for row in rows)
+            if changed:
+                deltas[name] = changed if value else -changed
+        if deltas:
+            UserCounter.add(deltas)
+        return [row.id for row in rows]
+
     @staticmethod
     def decode_auth_token(auth_token):
         """Decodes the auth token - :param auth_token: - :return: integer|string"""
+        payload = User.decode_auth_token_payload(auth_token)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_token_payload(auth_token):
+        """Verifies the auth token - :return: dict|string"""
+        algorithm = current_app.config.get('JWT_ALGORITHM')
         try:
-            payload = jwt.decode(
-                auth_token, current_app.config.get('SECRET_KEY'))
-            return payload['sub']
+            if algorithm.startswith('HS'):
+                key = current_app.config.get('SECRET_KEY')
+            else:
+                kid = jwt.get_unverified_header(auth_token).get('kid')
+                key = keyring.public_key(kid)
+                if key is None:
+                    raise jwt.InvalidTokenError('Unknown signing key.')
+            return jwt.decode(auth_token, key, algorithms=[algorithm])
         except jwt.ExpiredSignatureError:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please log in again.'
+
+
+# prefix search (GET /users/search) on lower(username) / lower(email)
+db.Index(
+    'ix_users_username_lower_pattern',
+    func.lower(User.username).label('username_lower'),
+    postgresql_ops={'username_lower': 'text_pattern_ops'}
+)
+db.Index(
+    'ix_users_email_lower_pattern',
+    func.lower(User.email).label('email_lower'),
+    postgresql_ops={'email_lower': 'text_pattern_ops'}
+)
+
+
+class ChangeCounter(db.Model):
+    """Per-table version, bumped in the same transaction as the writes"""
+    __tablename__ = "change_counters"
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def bump(name):
+        """Increments the version of `name` - single upsert, race free"""
+        now = datetime.datetime.utcnow()
+        table = ChangeCounter.__table__
+        db.session.execute(
+            insert(table).values(
+                name=name, version=1, updated_at=now
+            ).on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={'version': table.c.version + 1, 'updated_at': now}
+            )
+        )
+
+    @staticmethod
+    def get(name):
+        return ChangeCounter.query.filter_by(name=name).first()
+
+
+class UserCounter(db.Model):
+    """User counts maintained by the write paths, read without COUNT(*)"""
+    __tablename__ = "user_counters"
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+
+    @staticmethod
+    def add(deltas):
+        """Adds {name: delta} to the counters - single upsert"""
+        table = UserCounter.__table__
+        statement = insert(table).values(
+            [{'name': name, 'value': delta} for name, delta in deltas.items()]
+        )
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={'value': table.c.value + statement.excluded.value}
+        ))
+
+    @staticmethod
+    def record_signups(users):
+        """Counts new users, in the transaction inserting them"""
+        deltas = {'total': 0, 'active': 0, 'admin': 0}
+        days = {}
+        for user in users:
+            deltas['total'] += 1
+            # column defaults are only applied at flush
+            deltas['active'] += user.active is not False
+            deltas['admin'] += bool(user.admin)
+            day = user.created_at.date()
+            days[day] = days.get(day, 0) + 1
+        if not days:
+            return
+        UserCounter.add(deltas)
+        UserSignups.add(days)
+
+    @staticmethod
+    def get_all():
+        return {counter.name: counter.value for counter in UserCounter.query}
+
+    @staticmethod
+    def refresh():
+        """Recomputes every counter from the users table (backfill/repair)"""
+        UserCounter.query.delete()
+        UserSignups.query.delete()
+        total, active, admin = db.session.query(
+            func.count(User.id),
+            func.count(User.id).filter(User.active),
+            func.count(User.id).filter(User.admin)
+        ).one()
+        UserCounter.add({'total': total, 'active': active, 'admin': admin})
+        day = func.date(User.created_at)
+        signups = dict(
+            db.session.query(day, func.count(User.id)).group_by(day).all())
+        if signups:
+            UserSignups.add(signups)
+
+
+class UserSignups(db.Model):
+    """Signups per day, maintained along with UserCounter"""
+    __tablename__ = "user_signups"
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.BigInteger, default=0, nullable=False)
+
+    @staticmethod
+    def add(deltas):
+        """Adds {day: delta} to the daily counts - single upsert"""
+        table = UserSignups.__table__
+        statement = insert(table).values(
+            [{'day': day, 'count': delta} for day, delta in deltas.items()]
+        )
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.day],
+            set_={'count': table.c['count'] + statement.excluded['count']}
+        ))
+
+    @staticmethod
+    def since(day):
+        return UserSignups.query.filter(
+            UserSignups.day >= day).order_by(UserSignups.day).all()
+
+
+class RevokedToken(db.Model):
+    """Revocation store of the tokens, by `jti`, until they expire"""
+    __tablename__ = "revoked_tokens"
+    jti = db.Column(db.String(32), primary_key=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    # covers revocations committed after a sync that read past them
+    SYNC_MARGIN = datetime.timedelta(seconds=30)
+
+    @staticmethod
+    def now():
+        return datetime.datetime.utcnow()
+
+    @staticmethod
+    def revoke(jti, expires_at):
+        table = RevokedToken.__table__
+        db.session.execute(insert(table).values(
+            jti=jti, revoked_at=RevokedToken.now(), expires_at=expires_at
+        ).on_conflict_do_nothing(index_elements=[table.c.jti]))
+
+    @staticmethod
+    def is_revoked(jti):
+        return db.session.query(
+            RevokedToken.query.filter_by(jti=jti).exists()).scalar()
+
+    @staticmethod
+    def revoked_since(since):
+        """jti of the unexpired tokens revoked since `since` (or ever)"""
+        query = db.session.query(RevokedToken.jti).filter(
+            RevokedToken.expires_at > RevokedToken.now())
+        if since is not None:
+            query = query.filter(
+                RevokedToken.revoked_at >= since - RevokedToken.SYNC_MARGIN)
+        return [jti for jti, in query]
+
+    @staticmethod
+    def purge():
+        """Drops the revocations of expired tokens
+
+        Runs in its own connection and transaction: it is called while
+        authenticating, and must not commit the request's session.
+        """
+        table = RevokedToken.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                table.c.expires_at <= RevokedToken.now()))
+
+
+class LoginEvent(db.Model):
+    """Login attempts, written in batches by the audit log"""
+    __tablename__ = "login_events"
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    # kept for the failed attempts on unknown emails too
+    user_id = db.Column(db.Integer, index=True)
+    ip = db.Column(db.String(45))
+    outcome = db.Column(db.String(16), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @staticmethod
+    def write(events):
+        """Inserts a batch in one multi-row INSERT and commits"""
+        db.session.execute(insert(LoginEvent.__table__).values(events))
+        db.session.commit()
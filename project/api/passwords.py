@@ -0,0 +1,180 @@
+# project/api/passwords.py
+
+
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+from flask import current_app
+
+from project import bcrypt, hashing_pool
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+class BcryptHasher:
+    """bcrypt - `$2b$<rounds>$...`, cost from BCRYPT_LOG_ROUNDS"""
+    name = 'bcrypt'
+    prefix = '$2'
+
+    def __init__(self, rounds):
+        self.rounds = rounds
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('BCRYPT_LOG_ROUNDS'))
+
+    def hash(self, password):
+        return bcrypt.generate_password_hash(password, self.rounds).decode()
+
+    def verify(self, pw_hash, password):
+        return bcrypt.check_password_hash(pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return int(pw_hash.split('$')[2]) != self.rounds
+
+
+class ScryptHasher:
+    """scrypt (memory hard) - `$scrypt$ln=<log2 n>,r=<r>,p=<p>$salt$hash`"""
+    name = 'scrypt'
+    prefix = '$scrypt$'
+
+    def __init__(self, log_n, r, p):
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('SCRYPT_LOG_N'), config.get('SCRYPT_R'),
+                   config.get('SCRYPT_P'))
+
+    @property
+    def params(self):
+        return f'ln={self.log_n},r={self.r},p={self.p}'
+
+    @staticmethod
+    def derive(password, salt, log_n, r, p):
+        n = 2 ** log_n
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p,
+            maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        key = self.derive(password, salt, self.log_n, self.r, self.p)
+        return '$'.join([
+            '', 'scrypt', self.params,
+            base64.b64encode(salt).decode(), base64.b64encode(key).decode()
+        ])
+
+    def verify(self, pw_hash, password):
+        _, _, params, salt, key = pw_hash.split('$')
+        params = dict(param.split('=') for param in params.split(','))
+        expected = self.derive(
+            password, base64.b64decode(salt), int(params['ln']),
+            int(params['r']), int(params['p']))
+        return hmac.compare_digest(expected, base64.b64decode(key))
+
+    def needs_rehash(self, pw_hash):
+        return pw_hash.split('$')[2] != self.params
+
+
+class Argon2Hasher:
+    """argon2id (memory hard) - needs the optional argon2-cffi package"""
+    name = 'argon2'
+    prefix = '$argon2'
+
+    def __init__(self, time_cost, memory_cost, parallelism):
+        if argon2 is None:
+            raise RuntimeError('argon2-cffi is not installed.')
+        self.hasher = argon2.PasswordHasher(
+            time_cost=time_cost, memory_cost=memory_cost,
+            parallelism=parallelism)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('ARGON2_TIME_COST'),
+                   config.get('ARGON2_MEMORY_COST'),
+                   config.get('ARGON2_PARALLELISM'))
+
+    def hash(self, password):
+        return self.hasher.hash(password)
+
+    def verify(self, pw_hash, password):
+        try:
+            return self.hasher.verify(pw_hash, password)
+        except argon2.exceptions.VerificationError:
+            return False
+
+    def needs_rehash(self, pw_hash):
+        return self.hasher.check_needs_rehash(pw_hash)
+
+
+HASHERS = {
+    hasher.name: hasher
+    for hasher in (BcryptHasher, ScryptHasher, Argon2Hasher)
+}
+
+
+def configured_hasher():
+    """The hasher new passwords are hashed with (PASSWORD_HASHER)"""
+    config = current_app.config
+    return HASHERS[config.get('PASSWORD_HASHER')].from_config(config)
+
+
+def hasher_for(pw_hash):
+    """The hasher a stored hash was made with"""
+    for hasher in HASHERS.values():
+        if pw_hash.startswith(hasher.prefix):
+            return hasher.from_config(current_app.config)
+    raise ValueError('Unknown password hash.')
+
+
+def hash_password(password):
+    if not password:
+        raise ValueError('Password must be non-empty.')
+    return hashing_pool.submit(configured_hasher().hash, password)
+
+
+def hash_passwords(passwords):
+    """Hashes a batch in parallel - :return: list of hashes, in order"""
+    if not all(passwords):
+        raise ValueError('Password must be non-empty.')
+    return hashing_pool.map(configured_hasher().hash, passwords)
+
+
+def verify_password(pw_hash, password):
+    return hashing_pool.submit(hasher_for(pw_hash).verify, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """True if the algorithm or the cost differ from the configured ones"""
+    hasher = configured_hasher()
+    return not pw_hash.startswith(hasher.prefix) or \
+        hasher.needs_rehash(pw_hash)
+
+
+def calibrate(hasher_class, costs, target, samples=3):
+    """Times `hasher_class(cost)` for increasing costs
+
+    :return: (best cost under `target` seconds or None, [(cost, seconds)])
+    """
+    best, timings = None, []
+    for cost in costs:
+        hasher = hasher_class(*cost) if isinstance(cost, tuple) \
+            else hasher_class(cost)
+        start = time.perf_counter()
+        for _ in range(samples):
+            hasher.hash('calibration password')
+        elapsed = (time.perf_counter() - start) / samples
+        timings.append((cost, elapsed))
+        if elapsed > target:
+            break
+        best = cost
+    return best, timings
@@ -0,0 +1,134 @@
+# project/api/ratelimit.py
+
+
+import collections
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify
+from werkzeug.utils import import_string
+
+
+class MemoryStore:
+    """Token buckets in an ordered dict - O(1) per check
+
+    A bucket is dropped once it would be full again. Buckets are kept in
+    update order, so the sweep (at most every `eviction_interval`
+    seconds) pops from the least recently used end and stops at the
+    first bucket not full yet, instead of scanning them all.
+    """
+
+    def __init__(self, eviction_interval=60, clock=time.monotonic):
+        self.eviction_interval = eviction_interval
+        self.clock = clock
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._next_eviction = clock() + eviction_interval
+
+    def consume(self, key, capacity, period):
+        """Takes a token from `key` - :return: seconds to wait or 0"""
+        rate = capacity / period
+        now = self.clock()
+        with self._lock:
+            if now >= self._next_eviction:
+                self.evict(now)
+            tokens, last, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # the bucket is full again (and can be dropped) at full_at
+            full_at = now + (capacity - tokens) / rate
+            self._buckets[key] = (tokens, now, full_at)
+            self._buckets.move_to_end(key)
+            return 0 if allowed else (1 - tokens) * period / capacity
+
+    def evict(self, now):
+        """Drops the full buckets - called with the lock held"""
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[2] > now:
+                break
+            del self._buckets[key]
+        self._next_eviction = now + self.eviction_interval
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """Per-route token buckets keyed by client IP and by email
+
+    RATELIMIT_LIMITS maps a route name to `{kind: (capacity, period)}`,
+    the kinds being `ip` and `email`; RATELIMIT_STORE is the import
+    path of the store class.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.limits = {}
+        self.store = MemoryStore()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        self.limits = app.config.get('RATELIMIT_LIMITS', {})
+        self.store = import_string(app.config.get(
+            'RATELIMIT_STORE', 'project.api.ratelimit.MemoryStore'
+        ))(app.config.get('RATELIMIT_EVICTION_INTERVAL', 60))
+
+    def keys(self, name):
+        keys = {'ip': request.remote_addr}
+        post_data = request.get_json(silent=True)
+        if isinstance(post_data, dict) and \
+                isinstance(post_data.get('email'), str):
+            keys['email'] = post_data['email'].strip().lower()
+        return [
+            (f'{name}:{kind}:{key}', self.limits[name][kind])
+            for kind, key in keys.items() if kind in self.limits.get(name, {})
+        ]
+
+    def limit(self, name):
+        """Rejects the request with a 429 before the view runs"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if self.enabled:
+                    for key, (capacity, period) in self.keys(name):
+                        retry_after = self.store.consume(
+                            key, capacity, period)
+                        if retry_after:
+                            return self.too_many_requests(retry_after)
+                return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+
+    def too_many_requests(self, retry_after):
+        with self._lock:
+            self.rejected += 1
+        response_object = {
+            'status': 'error',
+            'message': 'Too many requests. Please try again later.'
+        }
+        response = jsonify(response_object)
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response
+
+    def reset(self):
+        self.store.clear()
+        with self._lock:
+            self.rejected = 0
+
+    def stats(self):
+        return {
+            'buckets': len(self.store),
+            'rejected': self.rejected
+        }
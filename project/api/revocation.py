@@ -0,0 +1,121 @@
+# project/api/revocation.py
+
+
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """Fixed size Bloom filter - no false negatives, `error_rate` positives"""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # double hashing, two 64 bits halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(key)
+        )
+
+
+class RevocationFilter:
+    """Revoked token ids, checked in memory before the revocation store
+
+    The store (RevokedToken) is the source of truth. Every
+    REVOCATION_SYNC_INTERVAL seconds the jti revoked since the last sync
+    (by any worker) are added to the filter; every
+    REVOCATION_REBUILD_INTERVAL seconds expired rows are purged and the
+    filter is rebuilt without them, as a Bloom filter cannot delete.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.store = None
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.sync_interval = 5
+        self.rebuild_interval = 3600
+        self._lock = threading.Lock()
+        self.reset()
+
+    def init_app(self, app, store):
+        self.store = store
+        self.capacity = app.config.get(
+            'REVOCATION_BLOOM_CAPACITY', self.capacity)
+        self.error_rate = app.config.get(
+            'REVOCATION_BLOOM_ERROR_RATE', self.error_rate)
+        self.sync_interval = app.config.get(
+            'REVOCATION_SYNC_INTERVAL', self.sync_interval)
+        self.rebuild_interval = app.config.get(
+            'REVOCATION_REBUILD_INTERVAL', self.rebuild_interval)
+        self.reset()
+
+    def reset(self):
+        """Forgets everything, the next check rebuilds from the store"""
+        with self._lock:
+            self.bloom = None
+            self.synced_at = None
+            self.next_sync = 0
+            self.next_rebuild = 0
+            self.store_lookups = 0
+
+    def sync(self):
+        now = self.clock()
+        if now < self.next_sync:
+            return
+        with self._lock:
+            if now < self.next_sync:
+                return
+            # wall clock, compared with RevokedToken.revoked_at
+            synced_at = self.store.now()
+            if now >= self.next_rebuild:
+                self.store.purge()
+                bloom = BloomFilter(self.capacity, self.error_rate)
+                for jti in self.store.revoked_since(None):
+                    bloom.add(jti)
+                self.bloom = bloom
+                self.next_rebuild = now + self.rebuild_interval
+            else:
+                for jti in self.store.revoked_since(self.synced_at):
+                    self.bloom.add(jti)
+            self.synced_at = synced_at
+            self.next_sync = now + self.sync_interval
+
+    def is_revoked(self, jti):
+        if jti is None:
+            return False
+        self.sync()
+        if jti not in self.bloom:
+            return False
+        # possibly a false positive
+        self.store_lookups += 1
+        return self.store.is_revoked(jti)
+
+    def revoke(self, jti, expires_at):
+        """Stores the revocation - the caller commits"""
+        self.store.revoke(jti, expires_at)
+        if self.bloom is not None:
+            self.bloom.add(jti)
+
+    def stats(self):
+        return {
+            'bloom_bits': self.bloom.size if self.bloom else 0,
+            'bloom_hashes': self.bloom.hashes if self.bloom else 0,
+            'store_lookups': self.store_lookups
+        }
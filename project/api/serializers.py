@@ -0,0 +1,90 @@
+# project/api/serializers.py
+
+
+import datetime
+import json
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# fields of a User per view, in output order
+PUBLIC_FIELDS = ('id', 'username', 'email', 'created_at')
+SELF_FIELDS = ('id', 'username', 'email', 'active', 'created_at')
+ADMIN_FIELDS = ('id', 'username', 'email', 'active', 'admin', 'created_at')
+
+
+def format_datetime(value):
+    """ISO-8601, UTC - created_at is stored as a naive UTC datetime"""
+    return value.isoformat(timespec='microseconds') + 'Z'
+
+
+# per-field converters, fields not listed are emitted as is
+CONVERTERS = {
+    'created_at': format_datetime
+}
+
+
+@lru_cache(maxsize=128)
+def compile_fields(fields, mapping=False):
+    """Builds the serializer of `fields` for objects/rows or for dicts"""
+    getter = (itemgetter if mapping else attrgetter)(*fields)
+    if len(fields) == 1:
+        # a single-field getter does not return a tuple
+        single = getter
+
+        def getter(obj):
+            return (single(obj),)
+    converters = tuple(
+        (index, CONVERTERS[field]) for index, field in enumerate(fields)
+        if field in CONVERTERS
+    )
+
+    def serialize(obj):
+        values = list(getter(obj))
+        for index, convert in converters:
+            if values[index] is not None:
+                values[index] = convert(values[index])
+        return dict(zip(fields, values))
+    return serialize
+
+
+def serialize_user(user, fields=PUBLIC_FIELDS):
+    """Serializes a User, a column row or a cached user record"""
+    return compile_fields(tuple(fields), isinstance(user, dict))(user)
+
+
+def serialize_users(users, fields=PUBLIC_FIELDS):
+    users = list(users)
+    if not users:
+        return []
+    serialize = compile_fields(tuple(fields), isinstance(users[0], dict))
+    return [serialize(user) for user in users]
+
+
+def default(value):
+    if isinstance(value, datetime.datetime):
+        return format_datetime(value)
+    raise TypeError(f'{value!r} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(
+            obj, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+else:
+    encoder = json.JSONEncoder(separators=(',', ':'), default=default)
+    dumps = encoder.encode
+
+
+def json_response(response_object, code=200):
+    """Compact JSON response - drop-in for `jsonify(...), code`"""
+    return current_app.response_class(
+        dumps(response_object), status=code, mimetype='application/json')
@@ -2,17 +2,43 @@
 
 
 from flask import Blueprint, jsonify, request, render_template
+from flask import Response, current_app, stream_with_context
 
-from project.api.models import User
-from project import db
-from project.api.utils import authenticate
-from project.api.utils import is_admin
+import datetime
+import itertools
+import json
 
-from sqlalchemy import exc
+from project.api.models import User, ChangeCounter, UserCounter, UserSignups
+from project import db, user_cache, token_version_cache
+from project.api.utils import authenticate, conditional
+from project.api.utils import is_admin, load_user
+from project.api.utils import encode_cursor, decode_cursor, parse_limit
+from project.api.utils import estimate_count, user_filters
+from project.api.utils import parse_fields, user_columns, escape_like
+from project.api.serializers import PUBLIC_FIELDS, dumps, json_response
+from project.api.serializers import compile_fields
+from project.api.passwords import hash_passwords
+from project.api.hashing import PoolFull
+from project.api.serializers import serialize_user, serialize_users
+
+from sqlalchemy import exc, tuple_, func, case, or_, text, union
 
 
 users_blueprint = Blueprint('users', __name__, template_folder='./templates')
 
+# default fields of GET /users/<id>
+SINGLE_USER_FIELDS = ('username', 'email', 'created_at')
+
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+# bulk rows over a column length would fail the whole batch INSERT
+BULK_MAX_LENGTHS = {
+    name: User.__table__.c[name].type.length for name in ('username', 'email')
+}
+
 
 @users_blueprint.route('/ping', methods=['GET'])
 def ping_pong():
@@ -24,8 +50,8 @@ def ping_pong():
 
 @users_blueprint.route('/users', methods=['POST'])
 @authenticate
-def add_user(resp):
-    if not is_admin(resp):
+def add_user(user):
+    if not is_admin(user):
         response_object = {
             'status': 'error',
             'message': 'You do not have permission to do that.'
@@ -41,25 +67,31 @@ def add_user(resp):
     username = post_data.get('username')
     email = post_data.get('email')
     password = post_data.get('password')
+    if not all(isinstance(value, str) and value
+               for value in (username, email, password)):
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid payload.'
+        }
+        return jsonify(response_object), 400
     try:
-        user = User.query.filter_by(email=email).first()
-        if not user:
-            db.session.add(
-                User(username=username,
-                     email=email,
-                     password=password))
-            db.session.commit()
-            response_object = {
-                'status': 'success',
-                'message': f'{email} was added!'
-            }
-            return jsonify(response_object), 201
-        else:
+        new_user, conflict = User.create(username, email, password)
+        if conflict:
+            db.session.rollback()
             response_object = {
                 'status': 'fail',
-                'message': 'Sorry. That email already exists.'
+                'message': f'Sorry. That {conflict} already exists.',
+                'conflict': conflict
             }
             return jsonify(response_object), 400
+        db.session.commit()
+        # drop a negative entry cached for the new id
+        user_cache.invalidate(new_user.id)
+        response_object = {
+            'status': 'success',
+            'message': f'{email} was added!'
+        }
+        return jsonify(response_object), 201
     except (exc.IntegrityError, ValueError) as e:
         db.session.rollback()
         response_object = {
@@ -69,7 +101,317 @@ def add_user(resp):
         return jsonify(response_object), 400
 
 
+@users_blueprint.route('/users', methods=['PATCH'])
+@authenticate
+def update_users(user):
+    """Sets `active` and/or `admin` on many users in one UPDATE
+
+    The users are picked by `ids` in the body and/or by the GET /users
+    filters in the query string.
+    """
+    if not is_admin(user):
+        response_object = {
+            'status': 'error',
+            'message': 'You do not have permission to do that.'
+        }
+        return jsonify(response_object), 401
+    post_data = request.get_json(silent=True)
+    values = {
+        name: post_data[name] for name in ('active', 'admin')
+        if name in post_data
+    } if isinstance(post_data, dict) else {}
+    ids = post_data.get('ids') if isinstance(post_data, dict) else None
+    if not values or \
+            not all(isinstance(value, bool) for value in values.values()) or \
+            (ids is not None and not valid_ids(ids)):
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid payload.'
+        }
+        return jsonify(response_object), 400
+    try:
+        criteria = user_filters()
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid filters.'
+        }
+        return jsonify(response_object), 400
+    if ids is not None:
+        criteria.append(User.id_in(ids))
+    if not criteria:
+        # never the whole table by accident
+        response_object = {
+            'status': 'fail',
+            'message': 'Provide ids or filters.'
+        }
+        return jsonify(response_object), 400
+    updated = User.set_flags(criteria, values)
+    db.session.commit()
+    user_cache.invalidate(*updated)
+    token_version_cache.invalidate(*updated)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'updated': len(updated)
+        }
+    }
+    return jsonify(response_object), 200
+
+
+def valid_ids(ids):
+    return isinstance(ids, list) and \
+        len(ids) <= current_app.config.get('USERS_BULK_MAX_ROWS') and \
+        all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+
+
+@users_blueprint.route('/users/bulk', methods=['POST'])
+@authenticate
+def add_users_bulk(user):
+    """Creates users from a JSON array or an NDJSON stream
+
+    Rows are validated, checked for duplicates, hashed and inserted
+    USERS_BULK_BATCH_SIZE at a time, one transaction per batch; NDJSON
+    is read line by line, so only a batch is held in memory. Answers
+    one `index`/`status` result per row. Reading stops at
+    USERS_BULK_MAX_ROWS (413), and a busy hashing pool ends the request
+    (503); both answer the results of the batches already committed.
+    """
+    if not is_admin(user):
+        response_object = {
+            'status': 'error',
+            'message': 'You do not have permission to do that.'
+        }
+        return jsonify(response_object), 401
+    max_rows = current_app.config.get('USERS_BULK_MAX_ROWS')
+    if request.mimetype == STREAM_MIMETYPES['ndjson']:
+        rows = read_ndjson(request.stream)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            response_object = {
+                'status': 'fail',
+                'message': 'Invalid payload.'
+            }
+            return jsonify(response_object), 400
+        if len(rows) > max_rows:
+            response_object = {
+                'status': 'fail',
+                'message': 'Too many rows.'
+            }
+            return jsonify(response_object), 413
+    batch_size = current_app.config.get('USERS_BULK_BATCH_SIZE')
+    rows = enumerate(rows)
+    accepted = itertools.islice(rows, max_rows)
+    batches = iter(lambda: list(itertools.islice(accepted, batch_size)), [])
+    results = []
+    try:
+        for batch in batches:
+            results.extend(create_users(batch))
+    except PoolFull:
+        db.session.rollback()
+        response = bulk_response(
+            results, 'error', 'Server busy. Please try again.', 503)
+        response.headers['Retry-After'] = '1'
+        return response
+    if next(rows, None) is not None:
+        # the rest of the stream is left unread
+        return bulk_response(results, 'fail', 'Too many rows.', 413)
+    return bulk_response(results)
+
+
+def bulk_response(results, status='success', message=None, code=200):
+    created = sum(result['status'] == 'success' for result in results)
+    response_object = {
+        'status': status,
+        'data': {
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        }
+    }
+    if message:
+        response_object['message'] = message
+    return json_response(response_object, code)
+
+
+def read_ndjson(stream):
+    """Yields the rows of an NDJSON body, None for an invalid line"""
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line.decode())
+        except ValueError:
+            yield None
+
+
+def bulk_result(index, message=None, user_id=None):
+    if message:
+        return {'index': index, 'status': 'fail', 'message': message}
+    return {'index': index, 'status': 'success', 'id': user_id}
+
+
+def valid_bulk_row(row):
+    """Non-empty strings, the username and email within their columns"""
+    return isinstance(row, dict) and all(
+        isinstance(row.get(key), str) and row[key]
+        for key in ('username', 'email', 'password')
+    ) and all(
+        len(row[key]) <= length for key, length in BULK_MAX_LENGTHS.items())
+
+
+def create_users(batch):
+    """Creates a batch of (index, row) - :return: per-row results"""
+    results = {}
+    candidates = []
+    for index, row in batch:
+        if valid_bulk_row(row):
+            candidates.append((index, row))
+        else:
+            results[index] = bulk_result(index, 'Invalid payload.')
+    # one query for the duplicates of the whole batch
+    existing = db.session.query(User.username, User.email).filter(or_(
+        User.username.in_({row['username'] for _, row in candidates}),
+        User.email.in_({row['email'] for _, row in candidates})
+    )).all() if candidates else []
+    usernames = {username for username, _ in existing}
+    emails = {email for _, email in existing}
+    new_rows = []
+    for index, row in candidates:
+        if row['email'] in emails:
+            results[index] = bulk_result(
+                index, 'Sorry. That email already exists.')
+        elif row['username'] in usernames:
+            results[index] = bulk_result(
+                index, 'Sorry. That username already exists.')
+        else:
+            # duplicates within the batch too
+            usernames.add(row['username'])
+            emails.add(row['email'])
+            new_rows.append((index, row))
+    if new_rows:
+        hashes = hash_passwords([row['password'] for _, row in new_rows])
+        now = datetime.datetime.utcnow()
+        try:
+            inserted = User.insert_many([
+                {
+                    'username': row['username'],
+                    'email': row['email'],
+                    'password': pw_hash,
+                    'created_at': now
+                }
+                for (_, row), pw_hash in zip(new_rows, hashes)
+            ])
+        except exc.DataError:
+            # a value the checks above let through: this batch only
+            db.session.rollback()
+            for index, _ in new_rows:
+                results[index] = bulk_result(index, 'Invalid payload.')
+            return [results[index] for index, _ in batch]
+        ids = {new_user.email: new_user.id for new_user in inserted}
+        for index, row in new_rows:
+            # lost a race with a concurrent insert
+            results[index] = bulk_result(index, user_id=ids[row['email']]) \
+                if row['email'] in ids else \
+                bulk_result(index, 'Sorry. That user already exists.')
+        if inserted:
+            ChangeCounter.bump(User.__tablename__)
+            UserCounter.record_signups(inserted)
+        db.session.commit()
+        # drop negative entries cached for the new ids
+        user_cache.invalidate(*ids.values())
+    return [results[index] for index, _ in batch]
+
+
+@users_blueprint.route('/users/search', methods=['GET'])
+def search_users():
+    """Prefix search on username and email"""
+    response_object = {
+        'status': 'fail',
+        'message': 'Invalid search parameters.'
+    }
+    query = request.args.get('q', '').strip().lower()
+    if len(query) < current_app.config.get('USERS_SEARCH_MIN_LENGTH'):
+        return jsonify(response_object), 400
+    try:
+        limit = int(request.args.get(
+            'limit', current_app.config.get('USERS_SEARCH_LIMIT')))
+    except ValueError:
+        return jsonify(response_object), 400
+    if limit < 1:
+        return jsonify(response_object), 400
+    limit = min(limit, current_app.config.get('USERS_SEARCH_MAX_LIMIT'))
+    # LIKE 'q%' on lower() is served by the text_pattern_ops indexes
+    pattern = escape_like(query) + '%'
+    username = func.lower(User.username)
+    email = func.lower(User.email)
+    rank = case([
+        (username == query, 0),
+        (email == query, 1),
+        (username.like(pattern), 2)
+    ], else_=3)
+    # only the exact matches and the first `limit` prefix matches of each
+    # index (range scans stopping at LIMIT) are ranked, not every match
+    candidates = union(*[
+        db.session.query(User.id).filter(criterion).subquery().select()
+        for criterion in (username == query, email == query)
+    ] + [
+        db.session.query(User.id).filter(column.like(pattern)).order_by(
+            # the text_pattern_ops order
+            text(f'lower(users.{name}) USING ~<~')
+        ).limit(limit).subquery().select()
+        for name, column in (('username', username), ('email', email))
+    ])
+    users = db.session.query(*user_columns(PUBLIC_FIELDS)).filter(
+        User.id.in_(candidates)
+    ).order_by(
+        rank, func.length(User.username), User.id
+    ).limit(limit).all()
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': serialize_users(users)
+        }
+    }
+    return json_response(response_object, 200)
+
+
+@users_blueprint.route('/users/stats', methods=['GET'])
+def get_users_stats():
+    """User totals and signups per day, from the maintained counters"""
+    try:
+        days = int(request.args.get(
+            'days', current_app.config.get('USERS_STATS_DAYS')))
+    except ValueError:
+        days = -1
+    if days < 1:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid days.'
+        }
+        return jsonify(response_object), 400
+    counters = UserCounter.get_all()
+    # created_at is stored in UTC, so is the "today" bucket
+    today = datetime.datetime.utcnow().date()
+    since = today - datetime.timedelta(days=days - 1)
+    response_object = {
+        'status': 'success',
+        'data': {
+            'total': counters.get('total', 0),
+            'active': counters.get('active', 0),
+            'admin': counters.get('admin', 0),
+            'signups': [
+                {'day': signups.day.isoformat(), 'count': signups.count}
+                for signups in UserSignups.since(since)
+            ]
+        }
+    }
+    return json_response(response_object, 200)
+
+
 @users_blueprint.route('/users/<user_id>', methods=['GET'])
+@conditional
 def get_single_user(user_id):
     """Get single user details"""
     response_object = {
@@ -77,43 +419,150 @@ def get_single_user(user_id):
         'message': 'User does not exist'
     }
     try:
-        user = User.query.filter_by(id=int(user_id)).first()
+        fields = parse_fields(SINGLE_USER_FIELDS, PUBLIC_FIELDS)
+    except ValueError:
+        return invalid_fields()
+    try:
+        user = load_user(int(user_id))
         if not user:
             return jsonify(response_object), 404
         else:
             response_object = {
                 'status': 'success',
-                'data': {
-                    'username': user.username,
-                    'email': user.email,
-                    'created_at': user.created_at
-                }
+                'data': serialize_user(user, fields)
             }
-            return jsonify(response_object), 200
+            return json_response(response_object, 200)
     except ValueError:
         return jsonify(response_object), 404
 
 
 @users_blueprint.route('/users', methods=['GET'])
+@conditional
 def get_all_users():
     """Get all users"""
-    users = User.query.order_by(User.created_at.desc()).all()
-    users_list = []
-    for user in users:
-        user_object = {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'created_at': user.created_at
-        }
-        users_list.append(user_object)
+    if request.method == 'HEAD':
+        return head_all_users()
+    try:
+        fields = parse_fields(PUBLIC_FIELDS)
+    except ValueError:
+        return invalid_fields()
+    try:
+        criteria = user_filters()
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid filters.'
+        }
+        return jsonify(response_object), 400
+    if 'stream' in request.args:
+        return stream_all_users(
+            request.args.get('stream'), fields, criteria)
+    if 'limit' in request.args or 'after' in request.args:
+        return get_users_page(fields, criteria)
+    users = db.session.query(*user_columns(fields)).filter(
+        *criteria
+    ).order_by(User.created_at.desc(), User.id.desc()).all()
     response_object = {
         'status': 'success',
         'data': {
-            'users': users_list
+            'users': serialize_users(users, fields)
         }
     }
-    return jsonify(response_object), 200
+    return json_response(response_object, 200)
+
+
+def head_all_users():
+    """HEAD /users - the total comes from the maintained counters"""
+    response = current_app.response_class(mimetype='application/json')
+    response.headers['X-Total-Count'] = str(
+        UserCounter.get_all().get('total', 0))
+    return response
+
+
+def get_users_page(fields, criteria):
+    """Get one page of users, keyset paginated on (created_at, id)"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        after = request.args.get('after')
+        cursor = decode_cursor(after) if after else None
+    except ValueError:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid pagination parameters.'
+        }
+        return jsonify(response_object), 400
+    # the cursor key is always loaded, but only requested fields are sent
+    query = db.session.query(
+        *user_columns(fields, 'created_at', 'id')
+    ).filter(
+        *criteria
+    ).order_by(User.created_at.desc(), User.id.desc())
+    if cursor:
+        query = query.filter(tuple_(User.created_at, User.id) < cursor)
+    # fetch one extra row to know whether there is a next page
+    users = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(users[limit - 1]) \
+        if len(users) > limit else None
+    response_object = {
+        'status': 'success',
+        'data': {
+            'users': serialize_users(users[:limit], fields),
+            'next_cursor': next_cursor
+        }
+    }
+    # the estimate covers the whole table, it is skipped when filtering
+    if request.args.get('count') == 'estimate' and not criteria:
+        response_object['data']['total'] = estimate_count(
+            User.__tablename__)
+    return json_response(response_object, 200)
+
+
+def stream_all_users(stream_format, fields, criteria):
+    """Stream all users as NDJSON or as a chunked JSON array"""
+    if stream_format not in STREAM_MIMETYPES:
+        response_object = {
+            'status': 'fail',
+            'message': 'Invalid stream format.'
+        }
+        return jsonify(response_object), 400
+    # server-side cursor, rows are fetched and encoded batch by batch
+    query = db.session.query(
+        *user_columns(fields)
+    ).filter(
+        *criteria
+    ).order_by(
+        User.created_at.desc(), User.id.desc()
+    ).execution_options(
+        stream_results=True
+    ).yield_per(current_app.config.get('USERS_STREAM_BATCH_SIZE'))
+    serialize = compile_fields(fields)
+
+    def generate_ndjson():
+        for row in query:
+            yield dumps(serialize(row)) + '\n'
+
+    def generate_json():
+        yield '{"status":"success","data":{"users":['
+        separator = ''
+        for row in query:
+            yield separator + dumps(serialize(row))
+            separator = ','
+        yield ']}}'
+
+    generate = generate_ndjson if stream_format == 'ndjson' \
+        else generate_json
+    return Response(
+        stream_with_context(generate()),
+        mimetype=STREAM_MIMETYPES[stream_format]
+    )
+
+
+def invalid_fields():
+    response_object = {
+        'status': 'fail',
+        'message': 'Invalid fields.'
+    }
+    return jsonify(response_object), 400
 
 
 # @users_blueprint.route('/', methods=['GET', 'POST'])
@@ -1,11 +1,30 @@
 # project/api/utils.py
 
 
+import base64
+import binascii
+import datetime
+import hashlib
+import time
 from functools import wraps
 
-from flask import request, jsonify
+from flask import request, jsonify, current_app, make_response, g
+from sqlalchemy import text
 
-from project.api.models import User
+from project import db, user_cache, token_cache, token_version_cache
+from project import revocation
+from project.api.cache import MISSING
+from project.api.compression import ENCODINGS
+from project.api.models import User, ChangeCounter
+
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+FILTER_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+# columns kept in the user cache - never the password hash
+CACHED_USER_FIELDS = (
+    'id', 'username', 'email', 'active', 'admin', 'created_at')
 
 
 def authenticate(f):
@@ -22,16 +41,206 @@ def authenticate(f):
             code = 403
             return jsonify(response_object), code
         auth_token = auth_header.split(" ")[1]
-        resp = User.decode_auth_token(auth_token)
-        if isinstance(resp, str):
-            response_object['message'] = resp
+        payload = decode_auth_token(auth_token)
+        if isinstance(payload, str):
+            response_object['message'] = payload
             return jsonify(response_object), code
-        user = User.query.filter_by(id=resp).first()
-        if not user or not user.active:
+        if revocation.is_revoked(payload.get('jti')):
+            response_object['message'] = 'Token revoked. Please log in again.'
             return jsonify(response_object), code
-        return f(resp, *args, **kwargs)
+        if 'ver' in payload:
+            # the claims stand for the user while the version is current
+            if not payload['active']:
+                return jsonify(response_object), code
+            if payload['ver'] != token_version(payload['sub']):
+                response_object['message'] = \
+                    'Token revoked. Please log in again.'
+                return jsonify(response_object), code
+            user = {
+                'id': payload['sub'],
+                'active': True,
+                'admin': payload['admin']
+            }
+        else:
+            # token issued before the claims
+            user = load_user(payload['sub'])
+            if not user or not user['active']:
+                return jsonify(response_object), code
+        # the view gets the record (load_user for the full one), logout
+        # reads the jti and exp of the payload
+        g.token_payload = payload
+        return f(user, *args, **kwargs)
+    return decorated_function
+
+
+def conditional(f):
+    """ETag / If-None-Match support for views reading the users table
+
+    The ETag is derived from the users change counter, so a matching
+    request is answered with a 304 without touching the users table.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        counter = ChangeCounter.get(User.__tablename__)
+        version = counter.version if counter else 0
+        etag = hashlib.sha1(
+            f'{version}:{request.full_path}'.encode()).hexdigest()
+        # compressed bodies carry a per-coding variant of the ETag
+        matched = [
+            tag for tag in [etag] + [f'{etag}-{e}' for e in ENCODINGS]
+            if request.if_none_match.contains(tag)
+        ]
+        if matched:
+            etag = matched[0]
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if counter:
+            response.last_modified = counter.updated_at
+        response.cache_control.max_age = current_app.config.get(
+            'USERS_CACHE_MAX_AGE')
+        response.cache_control.must_revalidate = True
+        return response
     return decorated_function
 
-def is_admin(user_id):
-    user = User.query.filter_by(id=user_id).first()
-    return user.admin
\ No newline at end of file
+
+def decode_auth_token(auth_token):
+    """User.decode_auth_token_payload behind the verified tokens cache
+
+    Valid tokens are kept no longer than their `exp`, invalid and
+    expired ones for TOKEN_CACHE_NEGATIVE_TTL.
+    """
+    payload = token_cache.get(auth_token)
+    if payload is MISSING:
+        payload = User.decode_auth_token_payload(auth_token)
+        if isinstance(payload, str):
+            token_cache.set(auth_token, payload, token_cache.negative_ttl)
+        else:
+            ttl = min(token_cache.ttl, payload['exp'] - time.time())
+            if ttl > 0:
+                token_cache.set(auth_token, payload, ttl)
+    return payload
+
+
+def is_admin(user):
+    return user['admin']
+
+
+def load_user(user_id):
+    """Read-through user cache - :return: dict|None"""
+    user = user_cache.get(user_id)
+    if user is MISSING:
+        # not cached if invalidated while loading, the row may be stale
+        generation = user_cache.generation
+        row = db.session.query(*user_columns(CACHED_USER_FIELDS)).filter(
+            User.id == user_id).first()
+        # unknown ids are cached too (negative entry)
+        user = row._asdict() if row else None
+        user_cache.set(user_id, user, generation=generation)
+    return user
+
+
+def token_version(user_id):
+    """Read-through token version cache - :return: int|None"""
+    version = token_version_cache.get(user_id)
+    if version is MISSING:
+        generation = token_version_cache.generation
+        version = db.session.query(User.token_version).filter(
+            User.id == user_id).scalar()
+        # deleted users are cached too (negative entry)
+        token_version_cache.set(user_id, version, generation=generation)
+    return version
+
+
+def encode_cursor(user):
+    """Builds the opaque cursor pointing right after `user`"""
+    key = f'{user.created_at.strftime(CURSOR_DATE_FORMAT)}|{user.id}'
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor - :return: (created_at, id) - raise ValueError"""
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, user_id = key.split('|')
+        return (datetime.datetime.strptime(created_at, CURSOR_DATE_FORMAT),
+                int(user_id))
+    except (TypeError, UnicodeError, binascii.Error) as e:
+        raise ValueError('Invalid cursor.') from e
+
+
+def parse_limit(limit):
+    """Validates the page size - raise ValueError"""
+    if limit is None:
+        return current_app.config.get('USERS_PAGE_SIZE')
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError('Invalid limit.')
+    return min(limit, current_app.config.get('USERS_MAX_PAGE_SIZE'))
+
+
+def estimate_count(table):
+    """Approximate row count from the planner statistics (no table scan)"""
+    count = db.session.execute(
+        text('SELECT reltuples::bigint FROM pg_class WHERE relname = :table'),
+        {'table': table}
+    ).scalar()
+    # reltuples is -1 (or missing) until the table has been analyzed
+    return max(count or 0, 0)
+
+
+def parse_fields(default, allowed=None):
+    """Parses the sparse fieldset - :return: tuple - raise ValueError"""
+    fields = request.args.get('fields')
+    if not fields:
+        return default
+    allowed = allowed or default
+    fields = {field.strip() for field in fields.split(',')}
+    if not fields <= set(allowed):
+        raise ValueError('Invalid fields.')
+    # one tuple per set of fields, in the order of `allowed`: the
+    # serializers are cached by it
+    return tuple(field for field in allowed if field in fields)
+
+
+def user_columns(fields, *required):
+    """Maps field names to User columns, so only those are SELECTed"""
+    names = list(fields) + [name for name in required if name not in fields]
+    return [getattr(User, name) for name in names]
+
+
+def escape_like(value):
+    """Escapes the LIKE wildcards with backslash, the default escape"""
+    return value.replace('\\', '\\\\').replace(
+        '%', '\\%').replace('_', '\\_')
+
+
+def user_filters():
+    """Parses the listing filters - :return: list - raise ValueError"""
+    criteria = []
+    for name in ('active', 'admin'):
+        value = request.args.get(name)
+        if value is not None:
+            if value.lower() not in BOOLEANS:
+                raise ValueError(f'Invalid {name} filter.')
+            criteria.append(getattr(User, name) == BOOLEANS[value.lower()])
+    created_after = request.args.get('created_after')
+    if created_after is not None:
+        criteria.append(User.created_at >= parse_date(created_after))
+    created_before = request.args.get('created_before')
+    if created_before is not None:
+        criteria.append(User.created_at < parse_date(created_before))
+    return criteria
+
+
+def parse_date(value):
+    """Parses an ISO-8601 date or datetime - raise ValueError"""
+    for date_format in FILTER_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid date.')
@@ -0,0 +1,135 @@
+# project/api/verifier.py
+"""Local verification of the auth tokens, for the downstream services
+
+Only depends on PyJWT and cryptography, so it can be copied as is:
+
+    verifier = TokenVerifier('https://users.example.com/auth/jwks')
+    payload = verifier.verify(auth_token)  # raises jwt.InvalidTokenError
+
+The public keys are fetched once from /auth/jwks and refetched when a
+token is signed with an unknown `kid` (key rotation), at most every
+`min_refresh_interval` seconds.
+"""
+
+
+import base64
+import json
+import threading
+import time
+import urllib.request
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding, PublicFormat)
+
+
+CURVES = {
+    'P-256': ec.SECP256R1,
+    'P-384': ec.SECP384R1,
+    'P-521': ec.SECP521R1
+}
+
+
+def b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64url_decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def int_to_b64url(value, length=None):
+    length = length or (value.bit_length() + 7) // 8
+    return b64url_encode(value.to_bytes(length, 'big'))
+
+
+def b64url_to_int(data):
+    return int.from_bytes(b64url_decode(data), 'big')
+
+
+def jwk_from_public_key(key, kid, algorithm):
+    """Public key -> JWK (RFC 7517) dict"""
+    jwk = {'kid': kid, 'alg': algorithm, 'use': 'sig'}
+    if isinstance(key, rsa.RSAPublicKey):
+        numbers = key.public_numbers()
+        jwk.update(kty='RSA', n=int_to_b64url(numbers.n),
+                   e=int_to_b64url(numbers.e))
+    elif isinstance(key, ec.EllipticCurvePublicKey):
+        numbers = key.public_numbers()
+        size = (key.curve.key_size + 7) // 8
+        crv = next(
+            name for name, curve in CURVES.items()
+            if curve.name == key.curve.name)
+        jwk.update(kty='EC', crv=crv, x=int_to_b64url(numbers.x, size),
+                   y=int_to_b64url(numbers.y, size))
+    elif isinstance(key, ed25519.Ed25519PublicKey):
+        jwk.update(kty='OKP', crv='Ed25519', x=b64url_encode(
+            key.public_bytes(Encoding.Raw, PublicFormat.Raw)))
+    else:
+        raise ValueError('Unsupported key type.')
+    return jwk
+
+
+def public_key_from_jwk(jwk):
+    """JWK dict -> public key"""
+    if jwk['kty'] == 'RSA':
+        return rsa.RSAPublicNumbers(
+            b64url_to_int(jwk['e']), b64url_to_int(jwk['n'])
+        ).public_key(default_backend())
+    if jwk['kty'] == 'EC':
+        return ec.EllipticCurvePublicNumbers(
+            b64url_to_int(jwk['x']), b64url_to_int(jwk['y']),
+            CURVES[jwk['crv']]()
+        ).public_key(default_backend())
+    if jwk['kty'] == 'OKP' and jwk['crv'] == 'Ed25519':
+        return ed25519.Ed25519PublicKey.from_public_bytes(
+            b64url_decode(jwk['x']))
+    raise ValueError('Unsupported key type.')
+
+
+class TokenVerifier:
+
+    def __init__(self, jwks_url, algorithms=('RS256', 'ES256', 'EdDSA'),
+                 min_refresh_interval=30, timeout=5):
+        self.jwks_url = jwks_url
+        self.algorithms = list(algorithms)
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.keys = {}
+        self.fetched_at = None
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """Reloads the key set from the JWKS endpoint"""
+        with urllib.request.urlopen(
+                self.jwks_url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read().decode())
+        self.keys = {
+            jwk['kid']: (public_key_from_jwk(jwk), jwk.get('alg'))
+            for jwk in jwks['keys']
+        }
+        self.fetched_at = time.monotonic()
+
+    def key(self, kid):
+        if kid not in self.keys:
+            with self._lock:
+                if kid not in self.keys and (
+                        self.fetched_at is None or
+                        time.monotonic() - self.fetched_at >=
+                        self.min_refresh_interval):
+                    self.fetch()
+        return self.keys.get(kid)
+
+    def verify(self, auth_token):
+        """:return: the payload - raise jwt.InvalidTokenError"""
+        kid = jwt.get_unverified_header(auth_token).get('kid')
+        key = self.key(kid)
+        if key is None:
+            raise jwt.InvalidTokenError('Unknown signing key.')
+        public_key, algorithm = key
+        if algorithm and algorithm not in self.algorithms:
+            raise jwt.InvalidTokenError('Algorithm not allowed.')
+        algorithms = [algorithm] if algorithm else self.algorithms
+        return jwt.decode(auth_token, public_key, algorithms=algorithms)
@@ -10,9 +10,69 @@ class BaseConfig:
     TESTING = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get('SECRET_KEY')
+    PASSWORD_HASHER = 'bcrypt'
     BCRYPT_LOG_ROUNDS = 13
+    SCRYPT_LOG_N = 15
+    SCRYPT_R = 8
+    SCRYPT_P = 1
+    ARGON2_TIME_COST = 2
+    ARGON2_MEMORY_COST = 65536
+    ARGON2_PARALLELISM = 2
     TOKEN_EXPIRATION_DAYS = 30
     TOKEN_EXPIRATION_SECONDS = 0
+    # HS256 signs with SECRET_KEY; RS256/ES256/EdDSA with JWT_PRIVATE_KEYS
+    JWT_ALGORITHM = 'HS256'
+    JWT_PRIVATE_KEYS = {}
+    JWT_ACTIVE_KID = None
+    JWKS_CACHE_MAX_AGE = 300
+    AUTH_INTROSPECT_MAX_TOKENS = 100
+    USERS_PAGE_SIZE = 50
+    USERS_MAX_PAGE_SIZE = 500
+    USERS_STREAM_BATCH_SIZE = 1000
+    USERS_CACHE_MAX_AGE = 0
+    USERS_STATS_DAYS = 30
+    USERS_SEARCH_MIN_LENGTH = 2
+    USERS_SEARCH_LIMIT = 20
+    USERS_SEARCH_MAX_LIMIT = 50
+    USERS_BULK_BATCH_SIZE = 500
+    USERS_BULK_MAX_ROWS = 100000
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_GZIP_LEVEL = 6
+    COMPRESSION_BROTLI_LEVEL = 4
+    COMPRESSION_STREAM_FLUSH_SIZE = 16384
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 30
+    USER_CACHE_NEGATIVE_TTL = 5
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 300
+    TOKEN_CACHE_NEGATIVE_TTL = 5
+    # bounds how long another worker honours a bumped token_version
+    TOKEN_VERSION_CACHE_SIZE = 10000
+    TOKEN_VERSION_CACHE_TTL = 5
+    TOKEN_VERSION_CACHE_NEGATIVE_TTL = 5
+    HASHING_POOL_WORKERS = 2
+    HASHING_POOL_QUEUE_SIZE = 16
+    HASHING_POOL_TIMEOUT = 30
+    REVOCATION_BLOOM_CAPACITY = 100000
+    REVOCATION_BLOOM_ERROR_RATE = 0.001
+    REVOCATION_SYNC_INTERVAL = 5
+    REVOCATION_REBUILD_INTERVAL = 3600
+    AUDIT_ENABLED = True
+    AUDIT_QUEUE_SIZE = 10000
+    AUDIT_BATCH_SIZE = 500
+    AUDIT_FLUSH_INTERVAL = 1.0
+    # 'drop' the event or 'block' the login when the queue is full
+    AUDIT_FULL_POLICY = 'drop'
+    AUDIT_BLOCK_TIMEOUT = 0.5
+    RATELIMIT_ENABLED = True
+    RATELIMIT_STORE = 'project.api.ratelimit.MemoryStore'
+    RATELIMIT_EVICTION_INTERVAL = 60
+    # route: {key: (capacity, period in seconds)}
+    RATELIMIT_LIMITS = {
+        'login': {'ip': (30, 60), 'email': (10, 60)},
+        'register': {'ip': (10, 60), 'email': (5, 60)}
+    }
 
 
 class DevelopmentConfig(BaseConfig):
@@ -3,7 +3,8 @@
 
 from flask_testing import TestCase
 
-from project import create_app, db
+from project import create_app, db, user_cache, token_cache, limiter
+from project import revocation, token_version_cache, audit
 
 app = create_app()
 
@@ -16,7 +17,14 @@ class BaseTestCase(TestCase):
     def setUp(self):
         db.create_all()
         db.session.commit()
+        user_cache.clear()
+        token_cache.clear()
+        token_version_cache.clear()
+        limiter.reset()
+        revocation.reset()
 
     def tearDown(self):
+        # login events still queued, before their table is dropped
+        audit.flush()
         db.session.remove()
         db.drop_all()
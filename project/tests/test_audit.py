@@ -0,0 +1,93 @@
+# project/tests/test_audit.py
+
+
+import unittest
+
+from flask import Flask
+
+from project import audit
+from project.api.audit import AuditLog
+from project.api.models import LoginEvent
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login
+
+
+class MemoryStore:
+
+    def __init__(self):
+        self.batches = []
+
+    def write(self, events):
+        self.batches.append(events)
+
+
+class TestAuditLog(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config.update(
+            AUDIT_QUEUE_SIZE=3, AUDIT_BATCH_SIZE=2, AUDIT_FLUSH_INTERVAL=0.1)
+        self.store = MemoryStore()
+        self.audit = AuditLog()
+        self.audit.init_app(app, self.store)
+        self.addCleanup(self.audit.close)
+        # record() takes the app of the context
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def test_batches(self):
+        for i in range(3):
+            self.audit.record(user_id=i)
+        self.audit.flush()
+        self.assertEqual(
+            sorted(event['user_id'] for batch in self.store.batches
+                   for event in batch), [0, 1, 2])
+        self.assertTrue(all(len(batch) <= 2 for batch in self.store.batches))
+        self.assertEqual(self.audit.stats()['written'], 3)
+
+    def test_apps(self):
+        other = Flask(__name__)
+        store = MemoryStore()
+        self.audit.init_app(other, store)
+        self.audit.record(user_id=0)
+        with other.app_context():
+            self.audit.record(user_id=1)
+        self.audit.flush()
+        self.assertEqual(self.store.batches, [[{'user_id': 0}]])
+        self.assertEqual(store.batches, [[{'user_id': 1}]])
+
+    def test_drop_when_full(self):
+        # no writer thread, the queue fills up
+        self.audit.start = lambda: None
+        self.addCleanup(delattr, self.audit, 'start')
+        for i in range(5):
+            self.audit.record(user_id=i)
+        self.assertEqual(self.audit.stats()['dropped'], 2)
+        self.assertEqual(self.audit.stats()['queued'], 3)
+
+    def test_block_when_full(self):
+        self.audit.start = lambda: None
+        self.addCleanup(delattr, self.audit, 'start')
+        self.audit.policy = 'block'
+        self.audit.block_timeout = 0.01
+        for i in range(4):
+            self.audit.record(user_id=i)
+        self.assertEqual(self.audit.stats()['dropped'], 1)
+
+
+class TestLoginEvents(BaseTestCase):
+
+    def test_login_events(self):
+        user = add_user('test', 'test@test.com', 'test')
+        with self.client:
+            response = login(self.client)
+            self.assertEqual(response.status_code, 200)
+            response = login(self.client, password='wrong')
+            self.assertEqual(response.status_code, 404)
+        audit.flush()
+        events = LoginEvent.query.order_by(LoginEvent.id).all()
+        self.assertEqual(
+            [(event.user_id, event.outcome) for event in events],
+            [(user.id, 'success'), (user.id, 'failure')])
+        self.assertTrue(events[0].ip)
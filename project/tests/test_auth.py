@@ -4,7 +4,7 @@
 import json
 import time
 
-from project import db
+from project import db, token_version_cache
 from project.api.models import User
 from project.tests.base import BaseTestCase
 from project.tests.utils import add_user
@@ -356,4 +356,143 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(data['status'] == 'error')
             self.assertTrue(
                 data['message'] == 'Something went wrong. Please contact us.')
-            self.assertEqual(response.status_code, 401)
\ No newline at end of file
+            self.assertEqual(response.status_code, 401)
+
+    def test_token_carries_claims(self):
+        user = add_user('test', 'test@test.com', 'test')
+        user.admin = True
+        db.session.commit()
+        auth_token = user.encode_auth_token(user.id)
+        payload = User.decode_auth_token_payload(auth_token)
+        self.assertTrue(payload['admin'])
+        self.assertTrue(payload['active'])
+        self.assertEqual(payload['ver'], 0)
+
+    def test_bumped_token_version_revokes_tokens(self):
+        user = add_user('test', 'test@test.com', 'test')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            headers = dict(
+                Authorization='Bearer ' + json.loads(
+                    resp_login.data.decode()
+                )['auth_token']
+            )
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            # the deactivation bumps token_version
+            User.set_flags([User.id == user.id], {'active': False})
+            db.session.commit()
+            token_version_cache.invalidate(user.id)
+            response = self.client.get('/auth/status', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertTrue(data['status'] == 'error')
+            self.assertTrue(
+                data['message'] == 'Token revoked. Please log in again.')
+            self.assertEqual(response.status_code, 401)
+
+    def test_introspect(self):
+        user = add_user('test', 'test@test.com', 'test')
+        inactive = add_user('test2', 'test2@test.com', 'test')
+        inactive.active = False
+        db.session.commit()
+        tokens = [
+            user.encode_auth_token(user.id).decode(),
+            'invalid',
+            inactive.encode_auth_token(inactive.id).decode()
+        ]
+        with self.client:
+            response = self.client.post(
+                '/auth/introspect',
+                data=json.dumps(dict(tokens=tokens)),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']), 3)
+            self.assertEqual(data['data'][0]['status'], 'success')
+            self.assertEqual(data['data'][0]['data']['email'], 'test@test.com')
+            self.assertTrue(data['data'][0]['data']['active'])
+            self.assertEqual(
+                data['data'][1]['message'],
+                'Invalid token. Please log in again.')
+            self.assertEqual(
+                data['data'][2]['message'],
+                'Something went wrong. Please contact us.')
+
+    def test_introspect_logged_out(self):
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
+            resp_login = self.client.post(
+                '/auth/login',
+                data=json.dumps(dict(
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+            auth_token = json.loads(resp_login.data.decode())['auth_token']
+            self.client.get(
+                '/auth/logout',
+                headers=dict(Authorization='Bearer ' + auth_token)
+            )
+            response = self.client.post(
+                '/auth/introspect',
+                data=json.dumps(dict(tokens=[auth_token])),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(
+                data['data'][0]['message'],
+                'Token revoked. Please log in again.')
+
+    def test_introspect_invalid_payload(self):
+        with self.client:
+            response = self.client.post(
+                '/auth/introspect',
+                data=json.dumps(dict(tokens='invalid')),
+                content_type='application/json'
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid payload.', data['message'])
+            response = self.client.post(
+                '/auth/introspect',
+                data=json.dumps(dict(tokens=['invalid'] * 101)),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_user_registration_conflict(self):
+        add_user('test', 'test@test.com', 'test')
+        with self.client:
+            response = self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='test',
+                    email='other@test.com',
+                    password='test'
+                )),
+                content_type='application/json',
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['conflict'], 'username')
+            response = self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='other',
+                    email='test@test.com',
+                    password='test'
+                )),
+                content_type='application/json',
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['conflict'], 'email')
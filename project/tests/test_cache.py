@@ -0,0 +1,142 @@
+# project/tests/test_cache.py
+
+
+import json
+import unittest
+
+from project import user_cache, token_cache
+from project.api.cache import LRUCache, MISSING
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login, auth_headers, FakeClock
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache('TEST', maxsize=2)
+        self.assertIs(cache.get(1), MISSING)
+        cache.set(1, 'one')
+        self.assertEqual(cache.get(1), 'one')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_eviction(self):
+        cache = LRUCache('TEST', maxsize=2)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.get(1)
+        cache.set(3, 'three')
+        self.assertIs(cache.get(2), MISSING)
+        self.assertEqual(cache.get(1), 'one')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache('TEST', ttl=10, negative_ttl=1, clock=clock)
+        cache.set(1, 'one')
+        cache.set(2, None)
+        clock.now = 5
+        self.assertEqual(cache.get(1), 'one')
+        self.assertIs(cache.get(2), MISSING)
+        clock.now = 10
+        self.assertIs(cache.get(1), MISSING)
+
+    def test_invalidate(self):
+        cache = LRUCache('TEST')
+        cache.set(1, 'one')
+        cache.invalidate(1)
+        self.assertIs(cache.get(1), MISSING)
+
+    def test_stale_fill(self):
+        cache = LRUCache('TEST')
+        generation = cache.generation
+        # invalidated while the old value was being loaded
+        cache.invalidate(1)
+        cache.set(1, 'old', generation=generation)
+        self.assertIs(cache.get(1), MISSING)
+        cache.set(1, 'new', generation=cache.generation)
+        self.assertEqual(cache.get(1), 'new')
+
+    def test_disabled(self):
+        cache = LRUCache('TEST', maxsize=0)
+        cache.set(1, 'one')
+        self.assertIs(cache.get(1), MISSING)
+
+
+class TestUserCache(BaseTestCase):
+
+    def test_single_user_is_cached(self):
+        user = add_user('michel', 'michel@meta.com', 'michelmichel')
+        with self.client:
+            self.client.get(f'/users/{user.id}')
+            response = self.client.get(f'/users/{user.id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(user_cache.stats()['hits'], 1)
+            self.assertEqual(user_cache.stats()['misses'], 1)
+
+    def test_unknown_user_is_negatively_cached(self):
+        with self.client:
+            self.client.get('/users/999')
+            response = self.client.get('/users/999')
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(user_cache.stats()['hits'], 1)
+
+    def test_metrics(self):
+        with self.client:
+            self.client.get('/users/999')
+            response = self.client.get('/metrics')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['user_cache']['misses'], 1)
+            self.assertIn('success', data['status'])
+
+
+class TestTokenCache(BaseTestCase):
+
+    def test_valid_token_is_cached(self):
+        add_user('test', 'test@test.com', 'test')
+        headers = auth_headers(login(self.client))
+        with self.client:
+            for _ in range(2):
+                response = self.client.get('/auth/status', headers=headers)
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(token_cache.stats()['hits'], 1)
+            self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_invalid_token_is_cached(self):
+        with self.client:
+            for _ in range(2):
+                response = self.client.get(
+                    '/auth/status',
+                    headers=dict(Authorization='Bearer invalid'))
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 401)
+                self.assertTrue(
+                    data['message'] == 'Invalid token. Please log in again.')
+            self.assertEqual(token_cache.stats()['hits'], 1)
+
+    def test_stale_fill(self):
+        cache = LRUCache('TEST')
+        generation = cache.generation
+        # invalidated while the old value was being loaded
+        cache.invalidate(1)
+        cache.set(1, 'old', generation=generation)
+        self.assertIs(cache.get(1), MISSING)
+        cache.set(1, 'new', generation=cache.generation)
+        self.assertEqual(cache.get(1), 'new')
+
+    def test_disabled(self):
+        add_user('test', 'test@test.com', 'test')
+        headers = auth_headers(login(self.client))
+        token_cache.maxsize = 0
+        try:
+            with self.client:
+                response = self.client.get('/auth/status', headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(token_cache.stats()['size'], 0)
+        finally:
+            token_cache.maxsize = self.app.config['TOKEN_CACHE_SIZE']
+
+
+if __name__ == '__main__':
+    unittest.main()
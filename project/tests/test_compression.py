@@ -0,0 +1,78 @@
+# project/tests/test_compression.py
+
+
+import gzip
+import json
+import unittest
+import zlib
+
+from project.api.compression import compress_stream
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user
+
+
+class TestCompressStream(unittest.TestCase):
+
+    def test_first_row_decodable(self):
+        rows = [f'{{"id":{i}}}\n' for i in range(3000)]
+        chunks = compress_stream(iter(rows), 'gzip', 6, 16384)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # flushed after the first row, not once the window is full
+        first = decompressor.decompress(next(chunks))
+        self.assertEqual(first.decode(), rows[0])
+        rest = decompressor.decompress(b''.join(chunks))
+        self.assertEqual((first + rest).decode(), ''.join(rows))
+
+
+class TestCompression(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['COMPRESSION_MIN_SIZE'] = 10
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        add_user('augustin', 'augustin@meta.com', 'augustinaugustin')
+
+    def test_gzip(self):
+        with self.client:
+            response = self.client.get(
+                '/users', headers={'Accept-Encoding': 'gzip'})
+            data = json.loads(gzip.decompress(response.data).decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertEqual(len(data['data']['users']), 2)
+
+    def test_gzip_stream(self):
+        # no `with self.client`: the streamed body pushes its own context
+        response = self.client.get(
+            '/users?stream=ndjson', headers={'Accept-Encoding': 'gzip'})
+        lines = gzip.decompress(response.data).decode().splitlines()
+        response.close()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(lines), 2)
+
+    def test_not_accepted(self):
+        with self.client:
+            response = self.client.get('/users')
+            data = json.loads(response.data.decode())
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(len(data['data']['users']), 2)
+
+    def test_below_threshold(self):
+        self.app.config['COMPRESSION_MIN_SIZE'] = 1024 * 1024
+        with self.client:
+            response = self.client.get(
+                '/users', headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_etag_per_encoding(self):
+        with self.client:
+            response = self.client.get(
+                '/users', headers={'Accept-Encoding': 'gzip'})
+            etag = response.headers['ETag']
+            self.assertTrue(etag.endswith('-gzip"'))
+            response = self.client.get('/users', headers={
+                'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], etag)
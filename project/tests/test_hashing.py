@@ -0,0 +1,118 @@
+# project/tests/test_hashing.py
+
+
+import json
+import threading
+import unittest
+
+from flask import Flask
+
+from project import hashing_pool
+from project.api.hashing import HashingPool, PoolFull, PoolTimeout
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login
+
+
+def fill(pool):
+    """Occupies every worker and queue slot until the event is set"""
+    release = threading.Event()
+    threads = [
+        threading.Thread(target=pool.submit, args=(release.wait,))
+        for _ in range(pool.workers + pool.queue_size)
+    ]
+    for thread in threads:
+        thread.start()
+    while pool.stats()['pending'] < len(threads):
+        pass
+    return release, threads
+
+
+class TestHashingPool(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config.update(
+            TEST_POOL_WORKERS=1, TEST_POOL_QUEUE_SIZE=1, TEST_POOL_TIMEOUT=5)
+        self.pool = HashingPool('TEST_POOL')
+        self.pool.init_app(app)
+
+    def test_submit(self):
+        self.assertEqual(self.pool.submit(sum, [1, 2]), 3)
+        self.assertEqual(self.pool.stats()['completed'], 1)
+        self.assertEqual(self.pool.stats()['pending'], 0)
+
+    def test_map(self):
+        # one call in flight at a time, the queue is never exceeded
+        self.assertEqual(
+            self.pool.map(abs, [-1, 2, -3, 4, -5]), [1, 2, 3, 4, 5])
+        self.assertEqual(self.pool.stats()['rejected'], 0)
+        self.assertEqual(self.pool.stats()['pending'], 0)
+
+    def test_full(self):
+        release, threads = fill(self.pool)
+        try:
+            self.assertEqual(self.pool.stats()['queue_depth'], 1)
+            self.assertRaises(PoolFull, self.pool.submit, sum, [1, 2])
+            self.assertEqual(self.pool.stats()['rejected'], 1)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(self.pool.submit(sum, [1, 2]), 3)
+
+    def test_timeout(self):
+        self.pool.timeout = 0.05
+        release = threading.Event()
+        # occupies the worker without waiting on it
+        busy = self.pool.enqueue(release.wait)
+        try:
+            self.assertRaises(PoolTimeout, self.pool.submit, sum, [1, 2])
+            self.assertEqual(self.pool.stats()['timeouts'], 1)
+            # the queued call was dropped
+            self.assertEqual(self.pool.stats()['pending'], 1)
+        finally:
+            release.set()
+            busy.result()
+
+
+class TestLoginPoolFull(BaseTestCase):
+
+    def test_login_busy(self):
+        add_user('test', 'test@test.com', 'test')
+        release, threads = fill(hashing_pool)
+        try:
+            with self.client:
+                response = login(self.client)
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], '1')
+                self.assertTrue(data['status'] == 'error')
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+
+    def test_login_timeout(self):
+        add_user('test', 'test@test.com', 'test')
+        timeout = hashing_pool.timeout
+        hashing_pool.timeout = 0.05
+        # every worker busy, the login hash waits in the queue
+        release = threading.Event()
+        busy = [
+            hashing_pool.enqueue(release.wait)
+            for _ in range(hashing_pool.workers)
+        ]
+        try:
+            with self.client:
+                response = login(self.client)
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], '1')
+        finally:
+            hashing_pool.timeout = timeout
+            release.set()
+            for future in busy:
+                future.result()
+
+
+if __name__ == '__main__':
+    unittest.main()
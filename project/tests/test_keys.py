@@ -0,0 +1,101 @@
+# project/tests/test_keys.py
+
+
+import json
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding, PrivateFormat, NoEncryption)
+
+from project import keyring
+from project.api.verifier import TokenVerifier, public_key_from_jwk
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login, auth_token
+
+
+def private_pem(private_key):
+    return private_key.private_bytes(
+        Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()).decode()
+
+
+class TestAsymmetricTokens(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.keys = keyring.private_keys, keyring.active_kid
+        self.app.config['JWT_ALGORITHM'] = 'RS256'
+        self.app.config['JWT_PRIVATE_KEYS'] = {
+            'old': private_pem(rsa.generate_private_key(
+                65537, 2048, default_backend())),
+            'new': private_pem(rsa.generate_private_key(
+                65537, 2048, default_backend()))
+        }
+        self.app.config['JWT_ACTIVE_KID'] = 'new'
+        keyring.init_app(self.app)
+
+    def tearDown(self):
+        keyring.private_keys, keyring.active_kid = self.keys
+        super().tearDown()
+
+    def test_rs256_token(self):
+        add_user('test', 'test@test.com', 'test')
+        token = auth_token(login(self.client))
+        self.assertEqual(jwt.get_unverified_header(token)['kid'], 'new')
+        with self.client:
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+
+    def test_rotated_key_still_verifies(self):
+        add_user('test', 'test@test.com', 'test')
+        token = auth_token(login(self.client))
+        keyring.active_kid = 'old'
+        with self.client:
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+
+    def test_jwks_local_verification(self):
+        add_user('test', 'test@test.com', 'test')
+        token = auth_token(login(self.client))
+        with self.client:
+            response = self.client.get('/auth/jwks')
+            jwks = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                sorted(jwk['kid'] for jwk in jwks['keys']), ['new', 'old'])
+            self.assertTrue(all(jwk['kty'] == 'RSA' for jwk in jwks['keys']))
+        # no network: preload the keys the verifier would fetch
+        verifier = TokenVerifier('http://users/auth/jwks')
+        verifier.keys = {
+            jwk['kid']: (public_key_from_jwk(jwk), jwk['alg'])
+            for jwk in jwks['keys']
+        }
+        verifier.fetched_at = 0
+        self.assertTrue(verifier.verify(token)['sub'])
+
+    def test_es256_jwks(self):
+        self.app.config['JWT_ALGORITHM'] = 'ES256'
+        self.app.config['JWT_PRIVATE_KEYS'] = {'ec': private_pem(
+            ec.generate_private_key(ec.SECP256R1(), default_backend()))}
+        self.app.config['JWT_ACTIVE_KID'] = 'ec'
+        keyring.init_app(self.app)
+        add_user('test', 'test@test.com', 'test')
+        token = auth_token(login(self.client))
+        with self.client:
+            jwks = json.loads(self.client.get('/auth/jwks').data.decode())
+            jwk = jwks['keys'][0]
+            self.assertEqual(jwk['crv'], 'P-256')
+            payload = jwt.decode(
+                token, public_key_from_jwk(jwk), algorithms=['ES256'])
+            self.assertTrue(payload['sub'])
+
+    def test_hs256_jwks_is_empty(self):
+        self.app.config['JWT_ALGORITHM'] = 'HS256'
+        with self.client:
+            jwks = json.loads(self.client.get('/auth/jwks').data.decode())
+            self.assertEqual(jwks['keys'], [])
@@ -0,0 +1,53 @@
+# project/tests/test_passwords.py
+
+
+from project.api.models import User
+from project.api.passwords import (
+    BcryptHasher, ScryptHasher, hash_password, verify_password, needs_rehash)
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login
+
+
+class TestPasswords(BaseTestCase):
+
+    def test_bcrypt(self):
+        pw_hash = hash_password('test')
+        self.assertTrue(pw_hash.startswith('$2b$04$'))
+        self.assertTrue(verify_password(pw_hash, 'test'))
+        self.assertFalse(verify_password(pw_hash, 'wrong'))
+        self.assertFalse(needs_rehash(pw_hash))
+        self.assertTrue(BcryptHasher(5).needs_rehash(pw_hash))
+
+    def test_scrypt(self):
+        self.app.config['PASSWORD_HASHER'] = 'scrypt'
+        self.app.config['SCRYPT_LOG_N'] = 10
+        pw_hash = hash_password('test')
+        self.assertTrue(pw_hash.startswith('$scrypt$ln=10,r=8,p=1$'))
+        self.assertTrue(verify_password(pw_hash, 'test'))
+        self.assertFalse(verify_password(pw_hash, 'wrong'))
+        self.assertFalse(needs_rehash(pw_hash))
+        self.assertTrue(ScryptHasher(11, 8, 1).needs_rehash(pw_hash))
+
+    def test_empty_password(self):
+        self.assertRaises(ValueError, hash_password, '')
+
+    def test_login_rehash_cost(self):
+        add_user('test', 'test@test.com', 'test')
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        with self.client:
+            response = login(self.client)
+            self.assertEqual(response.status_code, 200)
+            user = User.query.filter_by(email='test@test.com').first()
+            self.assertTrue(user.password.startswith('$2b$05$'))
+            self.assertEqual(login(self.client).status_code, 200)
+
+    def test_login_rehash_algorithm(self):
+        add_user('test', 'test@test.com', 'test')
+        self.app.config['PASSWORD_HASHER'] = 'scrypt'
+        self.app.config['SCRYPT_LOG_N'] = 10
+        with self.client:
+            response = login(self.client)
+            self.assertEqual(response.status_code, 200)
+            user = User.query.filter_by(email='test@test.com').first()
+            self.assertTrue(user.password.startswith('$scrypt$'))
+            self.assertEqual(login(self.client).status_code, 200)
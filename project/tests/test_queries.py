@@ -0,0 +1,129 @@
+# project/tests/test_queries.py
+
+
+import json
+
+from project import db, user_cache, revocation, audit
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login, auth_headers
+from project.tests.utils import count_queries
+
+
+class TestQueryCounts(BaseTestCase):
+    """Round trips per authenticated request, with the user cache off."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_size = user_cache.maxsize
+        user_cache.maxsize = 0
+        user = add_user('test', 'test@test.com', 'test')
+        user.admin = True
+        db.session.commit()
+        self.headers = auth_headers(login(self.client))
+        # load the revocation filter ahead, it is synced periodically
+        revocation.sync()
+        # and write the login event now, not during a measured request
+        audit.flush()
+
+    def tearDown(self):
+        user_cache.maxsize = self.cache_size
+        super().tearDown()
+
+    def user_loads(self, statements):
+        return [
+            statement for statement in statements
+            if statement.lstrip().startswith('SELECT') and
+            'FROM users' in statement and 'users.id =' in statement
+        ]
+
+    def test_status_queries(self):
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.get(
+                    '/auth/status', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            # token version check, then the full record for the body
+            self.assertEqual(len(statements), 2)
+
+    def test_logout_queries(self):
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.get(
+                    '/auth/logout', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(self.user_loads(statements)), 1)
+
+    def test_cached_token_version_queries(self):
+        with self.client:
+            self.client.get('/auth/status', headers=self.headers)
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='michel',
+                        email='michel@meta.com',
+                        password='michelmichel'
+                    )),
+                    content_type='application/json',
+                    headers=self.headers
+                )
+            self.assertEqual(response.status_code, 201)
+            # authorized from the token claims alone
+            self.assertEqual(len(self.user_loads(statements)), 0)
+
+    def test_add_user_queries(self):
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/users',
+                    data=json.dumps(dict(
+                        username='michel',
+                        email='michel@meta.com',
+                        password='michelmichel'
+                    )),
+                    content_type='application/json',
+                    headers=self.headers
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(self.user_loads(statements)), 1)
+
+    def test_introspect_queries(self):
+        users = [
+            add_user(f'user{i}', f'user{i}@test.com', 'test')
+            for i in range(3)
+        ]
+        tokens = [
+            user.encode_auth_token(user.id).decode() for user in users
+        ]
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/auth/introspect',
+                    data=json.dumps(dict(tokens=tokens)),
+                    content_type='application/json'
+                )
+            self.assertEqual(response.status_code, 200)
+            # the users of every token in one WHERE id IN (...)
+            self.assertEqual(len(statements), 1)
+            self.assertIn('IN', statements[0])
+
+    def test_register_queries(self):
+        with self.client:
+            with count_queries() as statements:
+                response = self.client.post(
+                    '/auth/register',
+                    data=json.dumps(dict(
+                        username='michel',
+                        email='michel@meta.com',
+                        password='michelmichel'
+                    )),
+                    content_type='application/json'
+                )
+            self.assertEqual(response.status_code, 201)
+            users = [
+                statement for statement in statements
+                if 'FROM users ' in statement or 'INTO users ' in statement
+            ]
+            # the conflict check, then INSERT ... RETURNING
+            self.assertEqual(len(users), 2)
+            self.assertTrue(users[1].lstrip().startswith('INSERT'))
@@ -0,0 +1,60 @@
+# project/tests/test_ratelimit.py
+
+
+import json
+import unittest
+
+from project import limiter
+from project.api.ratelimit import MemoryStore
+from project.tests.base import BaseTestCase
+from project.tests.utils import login, FakeClock
+
+
+class TestMemoryStore(unittest.TestCase):
+
+    def test_consume(self):
+        clock = FakeClock()
+        store = MemoryStore(clock=clock)
+        self.assertEqual(store.consume('key', 2, 10), 0)
+        self.assertEqual(store.consume('key', 2, 10), 0)
+        self.assertEqual(store.consume('key', 2, 10), 5)
+        clock.now = 5
+        self.assertEqual(store.consume('key', 2, 10), 0)
+        self.assertEqual(store.consume('other', 2, 10), 0)
+
+    def test_eviction(self):
+        clock = FakeClock()
+        store = MemoryStore(eviction_interval=1, clock=clock)
+        store.consume('key', 2, 10)
+        clock.now = 2
+        store.consume('other', 2, 10)
+        self.assertEqual(len(store), 2)
+        clock.now = 20
+        store.consume('other', 2, 10)
+        self.assertEqual(len(store), 1)
+
+
+class TestRateLimit(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.limits = limiter.limits
+        limiter.limits = {'login': {'ip': (10, 60), 'email': (2, 60)}}
+
+    def tearDown(self):
+        limiter.limits = self.limits
+        super().tearDown()
+
+    def test_login_limited_by_email(self):
+        with self.client:
+            response = login(self.client, 'test@test.com')
+            self.assertEqual(response.status_code, 404)
+            response = login(self.client, 'TEST@test.com')
+            self.assertEqual(response.status_code, 404)
+            response = login(self.client, 'test@test.com')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(data['status'] == 'error')
+            self.assertEqual(response.headers['Retry-After'], '30')
+            response = login(self.client, 'other@test.com')
+            self.assertEqual(response.status_code, 404)
@@ -0,0 +1,73 @@
+# project/tests/test_revocation.py
+
+
+import json
+import unittest
+import uuid
+
+from project import db, revocation
+from project.api.models import User
+from project.api.revocation import BloomFilter
+from project.tests.base import BaseTestCase
+from project.tests.utils import add_user, login, auth_headers
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [uuid.uuid4().hex for _ in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_error_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for _ in range(1000):
+            bloom.add(uuid.uuid4().hex)
+        false_positives = sum(
+            uuid.uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestRevocation(BaseTestCase):
+
+    def test_logout_revokes_token(self):
+        add_user('test', 'test@test.com', 'test')
+        headers = auth_headers(login(self.client))
+        with self.client:
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get('/auth/logout', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get('/auth/status', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(
+                data['message'] == 'Token revoked. Please log in again.')
+
+    def test_revocation_seen_after_rebuild(self):
+        add_user('test', 'test@test.com', 'test')
+        headers = auth_headers(login(self.client))
+        with self.client:
+            self.client.get('/auth/logout', headers=headers)
+            # as another worker would see it, from the store only
+            revocation.reset()
+            response = self.client.get('/auth/status', headers=headers)
+            self.assertEqual(response.status_code, 401)
+
+    def test_not_revoked_skips_store(self):
+        add_user('test', 'test@test.com', 'test')
+        headers = auth_headers(login(self.client))
+        with self.client:
+            self.client.get('/auth/status', headers=headers)
+            self.assertEqual(revocation.stats()['store_lookups'], 0)
+
+    def test_rebuild_does_not_commit_session(self):
+        db.session.add(User(
+            username='pending', email='pending@test.com', password='test'))
+        revocation.reset()
+        revocation.sync()
+        # the purge ran in its own transaction
+        db.session.rollback()
+        self.assertEqual(User.query.filter_by(username='pending').count(), 0)
@@ -0,0 +1,48 @@
+# project/tests/test_serializers.py
+
+
+import collections
+import datetime
+import json
+import unittest
+
+from project.api.serializers import (
+    ADMIN_FIELDS, format_datetime, serialize_user, serialize_users, dumps)
+
+
+CREATED_AT = datetime.datetime(2017, 6, 1, 12, 30)
+Row = collections.namedtuple('Row', ADMIN_FIELDS)
+
+
+class TestSerializers(unittest.TestCase):
+
+    def test_format_datetime(self):
+        self.assertEqual(
+            format_datetime(CREATED_AT), '2017-06-01T12:30:00.000000Z')
+
+    def test_serialize_row(self):
+        row = Row(1, 'michel', 'michel@meta.com', True, False, CREATED_AT)
+        self.assertEqual(serialize_user(row), {
+            'id': 1,
+            'username': 'michel',
+            'email': 'michel@meta.com',
+            'created_at': '2017-06-01T12:30:00.000000Z'
+        })
+
+    def test_serialize_record(self):
+        record = Row(
+            1, 'michel', 'michel@meta.com', True, False, CREATED_AT
+        )._asdict()
+        self.assertEqual(
+            serialize_user(record, ('username',)), {'username': 'michel'})
+        self.assertEqual(
+            serialize_users([record], ADMIN_FIELDS)[0]['admin'], False)
+
+    def test_dumps(self):
+        data = json.loads(dumps({'created_at': CREATED_AT, 'id': 1}))
+        self.assertEqual(data['created_at'], '2017-06-01T12:30:00.000000Z')
+        self.assertNotIn(' ', dumps({'id': 1, 'username': 'michel'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,8 +6,10 @@ import datetime
 
 from project.tests.base import BaseTestCase
 from project import db
-from project.api.models import User
-from project.tests.utils import add_user
+from project.api.models import User, UserCounter
+from project.api import users
+from project.api.hashing import PoolFull
+from project.tests.utils import add_user, login, auth_headers
 
 
 class TestUserService(BaseTestCase):
@@ -170,6 +172,251 @@ class TestUserService(BaseTestCase):
                 'Sorry. That email already exists.', data['message'])
             self.assertIn('fail', data['status'])
 
+    def admin_headers(self):
+        user = add_user('test', 'test@test.com', 'test')
+        user.admin = True
+        db.session.commit()
+        return auth_headers(login(self.client))
+
+    def test_add_users_bulk(self):
+        """Ensure users can be added in bulk, with per-row results."""
+        headers = self.admin_headers()
+        self.app.config['USERS_BULK_BATCH_SIZE'] = 2
+        total = UserCounter.get_all()['total']
+        with self.client:
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(username='michel', email='michel@meta.com',
+                         password='michelmichel'),
+                    dict(username='augustin', email='test@test.com',
+                         password='augustin'),
+                    dict(username='michel', email='michel2@meta.com',
+                         password='michelmichel'),
+                    dict(username='jbjouvin', email='jbjouvin@gmail.com'),
+                    dict(username='jb', email='jb@gmail.com', password='jb')
+                ]),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['created'], 2)
+            self.assertEqual(data['data']['failed'], 3)
+            results = data['data']['results']
+            self.assertEqual([r['index'] for r in results], list(range(5)))
+            self.assertEqual(results[0]['status'], 'success')
+            self.assertEqual(
+                results[1]['message'], 'Sorry. That email already exists.')
+            self.assertEqual(
+                results[2]['message'], 'Sorry. That username already exists.')
+            self.assertEqual(results[3]['message'], 'Invalid payload.')
+            self.assertEqual(results[4]['status'], 'success')
+            self.assertEqual(User.query.count(), 3)
+            self.assertEqual(UserCounter.get_all()['total'], total + 2)
+
+    def test_add_users_bulk_too_long(self):
+        """Ensure a value longer than its column fails its row only."""
+        headers = self.admin_headers()
+        with self.client:
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(username='m' * 129, email='michel@meta.com',
+                         password='michelmichel'),
+                    dict(username='jb', email='jb@gmail.com', password='jb')
+                ]),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            results = data['data']['results']
+            self.assertEqual(results[0]['message'], 'Invalid payload.')
+            self.assertEqual(results[1]['status'], 'success')
+
+    def test_add_users_bulk_ndjson(self):
+        """Ensure users can be added in bulk from an NDJSON stream."""
+        headers = self.admin_headers()
+        self.app.config['USERS_BULK_MAX_ROWS'] = 2
+        lines = [
+            json.dumps(dict(username=f'user{i}', email=f'user{i}@test.com',
+                            password='password'))
+            for i in range(3)
+        ]
+        with self.client:
+            response = self.client.post(
+                '/users/bulk',
+                data='\n'.join(lines[:1] + ['{invalid'] + lines[1:]),
+                content_type='application/x-ndjson',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(data['message'], 'Too many rows.')
+            results = data['data']['results']
+            self.assertEqual(len(results), 2)
+            self.assertEqual(results[0]['status'], 'success')
+            self.assertEqual(results[1]['message'], 'Invalid payload.')
+            self.assertEqual(User.query.count(), 2)
+
+    def test_add_users_bulk_too_many(self):
+        """Ensure a JSON array over the cap is refused as a whole."""
+        headers = self.admin_headers()
+        self.app.config['USERS_BULK_MAX_ROWS'] = 1
+        with self.client:
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([
+                    dict(username='michel', email='michel@meta.com',
+                         password='michelmichel'),
+                    dict(username='jb', email='jb@gmail.com', password='jb')
+                ]),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(data['message'], 'Too many rows.')
+            self.assertEqual(User.query.count(), 1)
+
+    def test_add_users_bulk_busy(self):
+        """Ensure the committed batches are answered when the pool is full."""
+        headers = self.admin_headers()
+        self.app.config['USERS_BULK_BATCH_SIZE'] = 1
+        calls = []
+
+        def hash_passwords(passwords):
+            calls.append(passwords)
+            if len(calls) > 1:
+                raise PoolFull()
+            return original(passwords)
+        original, users.hash_passwords = users.hash_passwords, hash_passwords
+        try:
+            with self.client:
+                response = self.client.post(
+                    '/users/bulk',
+                    data=json.dumps([
+                        dict(username='michel', email='michel@meta.com',
+                             password='michelmichel'),
+                        dict(username='jb', email='jb@gmail.com',
+                             password='jb')
+                    ]),
+                    content_type='application/json',
+                    headers=headers
+                )
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], '1')
+                self.assertEqual(data['data']['created'], 1)
+                self.assertEqual(len(data['data']['results']), 1)
+                self.assertEqual(User.query.count(), 2)
+        finally:
+            users.hash_passwords = original
+
+    def test_add_users_bulk_not_admin(self):
+        """Ensure only admins can add users in bulk."""
+        add_user('test', 'test@test.com', 'test')
+        resp_login = self.client.post(
+            '/auth/login',
+            data=json.dumps(dict(email='test@test.com', password='test')),
+            content_type='application/json'
+        )
+        headers = dict(
+            Authorization='Bearer ' + json.loads(
+                resp_login.data.decode()
+            )['auth_token']
+        )
+        with self.client:
+            response = self.client.post(
+                '/users/bulk',
+                data=json.dumps([]),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertIn(
+                'You do not have permission to do that.', data['message'])
+
+    def test_update_users(self):
+        """Ensure users can be deactivated in one request."""
+        headers = self.admin_headers()
+        michel = add_user('michel', 'michel@meta.com', 'michelmichel')
+        augustin = add_user('augustin', 'augustin@meta.com', 'augustin')
+        UserCounter.refresh()
+        db.session.commit()
+        michel_token = michel.encode_auth_token(michel.id).decode()
+        with self.client:
+            response = self.client.patch(
+                '/users',
+                data=json.dumps(dict(
+                    ids=[michel.id, augustin.id], active=False)),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['updated'], 2)
+            self.assertEqual(UserCounter.get_all()['active'], 1)
+            # already inactive, nothing changes
+            response = self.client.patch(
+                '/users',
+                data=json.dumps(dict(ids=[michel.id], active=False)),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['updated'], 0)
+            # the tokens issued before are revoked
+            response = self.client.get(
+                '/auth/status',
+                headers=dict(Authorization='Bearer ' + michel_token)
+            )
+            self.assertEqual(response.status_code, 401)
+
+    def test_update_users_filters(self):
+        """Ensure users matching the listing filters can be promoted."""
+        headers = self.admin_headers()
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        UserCounter.refresh()
+        db.session.commit()
+        with self.client:
+            response = self.client.patch(
+                '/users?admin=false',
+                data=json.dumps(dict(admin=True)),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['updated'], 1)
+            self.assertEqual(User.query.filter_by(admin=True).count(), 2)
+            self.assertEqual(UserCounter.get_all()['admin'], 2)
+
+    def test_update_users_invalid(self):
+        """Ensure updates need values and ids or filters."""
+        headers = self.admin_headers()
+        with self.client:
+            response = self.client.patch(
+                '/users',
+                data=json.dumps(dict(active=False)),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Provide ids or filters.', data['message'])
+            response = self.client.patch(
+                '/users',
+                data=json.dumps(dict(ids=[1], active='no')),
+                content_type='application/json',
+                headers=headers
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid payload.', data['message'])
+
     def test_single_user(self):
         """Ensure get single user behaves correctly."""
         user = add_user('michel', 'michel@meta.com', 'michelmichel')
@@ -220,6 +467,244 @@ class TestUserService(BaseTestCase):
                 'augustin@meta.com', data['data']['users'][0]['email'])
             self.assertIn('success', data['status'])
 
+    def test_all_users_paginated(self):
+        """Ensure get all users pages through users with a cursor."""
+        created = datetime.datetime.utcnow() + datetime.timedelta(-30)
+        add_user('michel', 'michel@meta.com', 'michelmichel', created)
+        add_user('augustin', 'augustin@meta.com', 'augustinaugustin')
+        with self.client:
+            response = self.client.get('/users?limit=1&count=estimate')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 1)
+            self.assertIn('augustin', data['data']['users'][0]['username'])
+            self.assertTrue(data['data']['next_cursor'])
+            self.assertTrue(isinstance(data['data']['total'], int))
+            response = self.client.get(
+                f'/users?limit=1&after={data["data"]["next_cursor"]}')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(data['data']['users']), 1)
+            self.assertIn('michel', data['data']['users'][0]['username'])
+            self.assertIsNone(data['data']['next_cursor'])
+            self.assertIn('success', data['status'])
+
+    def test_all_users_invalid_cursor(self):
+        """Ensure error is thrown if the cursor is not valid."""
+        with self.client:
+            response = self.client.get('/users?after=blah')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid pagination parameters.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_all_users_stream_ndjson(self):
+        """Ensure get all users can stream users as NDJSON."""
+        created = datetime.datetime.utcnow() + datetime.timedelta(-30)
+        add_user('michel', 'michel@meta.com', 'michelmichel', created)
+        add_user('augustin', 'augustin@meta.com', 'augustinaugustin')
+        # no `with self.client`: the streamed body pushes its own context
+        response = self.client.get('/users?stream=ndjson')
+        lines = response.data.decode().splitlines()
+        response.close()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('augustin', json.loads(lines[0])['username'])
+        self.assertIn('michel', json.loads(lines[1])['username'])
+
+    def test_all_users_stream_json(self):
+        """Ensure get all users can stream users as a JSON array."""
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        add_user('augustin', 'augustin@meta.com', 'augustinaugustin')
+        response = self.client.get('/users?stream=json')
+        data = json.loads(response.data.decode())
+        response.close()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['data']['users']), 2)
+        self.assertTrue('created_at' in data['data']['users'][0])
+        self.assertIn('success', data['status'])
+
+    def test_all_users_stream_invalid_format(self):
+        """Ensure error is thrown if the stream format is not supported."""
+        with self.client:
+            response = self.client.get('/users?stream=xml')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid stream format.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_all_users_fields(self):
+        """Ensure get all users only returns the requested fields."""
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        with self.client:
+            response = self.client.get('/users?fields=id,username')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                set(data['data']['users'][0]), {'id', 'username'})
+            self.assertIn('michel', data['data']['users'][0]['username'])
+
+    def test_all_users_fields_order(self):
+        """Ensure the requested fields come once, in the default order."""
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        with self.client:
+            response = self.client.get('/users?fields=username,id,username')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                list(data['data']['users'][0]), ['id', 'username'])
+
+    def test_single_user_fields(self):
+        """Ensure get single user only returns the requested fields."""
+        user = add_user('michel', 'michel@meta.com', 'michelmichel')
+        with self.client:
+            response = self.client.get(f'/users/{user.id}?fields=id,email')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(data['data']), {'id', 'email'})
+            self.assertEqual(data['data']['id'], user.id)
+
+    def test_all_users_invalid_fields(self):
+        """Ensure error is thrown if a field is not exposed."""
+        with self.client:
+            response = self.client.get('/users?fields=id,password')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid fields.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_all_users_not_modified(self):
+        """Ensure get all users honours If-None-Match."""
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        with self.client:
+            response = self.client.get('/users')
+            etag = response.headers.get('ETag')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(etag)
+            self.assertIn('must-revalidate', response.headers['Cache-Control'])
+            response = self.client.get(
+                '/users', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers.get('ETag'), etag)
+
+    def test_all_users_etag_changes_on_write(self):
+        """Ensure the users ETag changes once a user is registered."""
+        with self.client:
+            etag = self.client.get('/users').headers.get('ETag')
+            self.client.post(
+                '/auth/register',
+                data=json.dumps(dict(
+                    username='michel',
+                    email='michel@meta.com',
+                    password='michelmichel'
+                )),
+                content_type='application/json'
+            )
+            response = self.client.get(
+                '/users', headers={'If-None-Match': etag})
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers.get('ETag'), etag)
+            self.assertTrue(response.headers.get('Last-Modified'))
+            self.assertEqual(len(data['data']['users']), 1)
+
+    def test_search_users(self):
+        """Ensure search ranks prefix matches on username and email."""
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        add_user('mich', 'augustin@meta.com', 'augustinaugustin')
+        add_user('augustin', 'mi@meta.org', 'augustinaugustin')
+        add_user('bob', 'bob@meta.org', 'bobbob')
+        with self.client:
+            response = self.client.get('/users/search?q=Mich')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [user['username'] for user in data['data']['users']],
+                ['mich', 'michel'])
+            response = self.client.get('/users/search?q=mi&limit=1')
+            data = json.loads(response.data.decode())
+            self.assertEqual(len(data['data']['users']), 1)
+            self.assertIn('success', data['status'])
+
+    def test_search_users_query_too_short(self):
+        """Ensure error is thrown if the search query is too short."""
+        with self.client:
+            response = self.client.get('/users/search?q=m')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid search parameters.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_all_users_filters(self):
+        """Ensure get all users filters on active, admin and created_at."""
+        created = datetime.datetime.utcnow() + datetime.timedelta(-30)
+        add_user('michel', 'michel@meta.com', 'michelmichel', created)
+        user = add_user('augustin', 'augustin@meta.com', 'augustinaugustin')
+        user.active = False
+        user.admin = True
+        db.session.commit()
+        since = (created + datetime.timedelta(1)).strftime('%Y-%m-%d')
+        with self.client:
+            for query, username in [
+                    ('active=false', 'augustin'),
+                    ('active=true', 'michel'),
+                    ('admin=true', 'augustin'),
+                    (f'created_before={since}', 'michel'),
+                    (f'created_after={since}&limit=10', 'augustin')]:
+                response = self.client.get(f'/users?{query}')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(data['data']['users']), 1)
+                self.assertIn(
+                    username, data['data']['users'][0]['username'])
+
+    def test_all_users_invalid_filters(self):
+        """Ensure error is thrown if a filter is not valid."""
+        with self.client:
+            response = self.client.get('/users?created_after=yesterday')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid filters.', data['message'])
+            self.assertIn('fail', data['status'])
+
+    def test_users_stats(self):
+        """Ensure users stats are maintained by the write paths."""
+        with self.client:
+            for username in ('michel', 'augustin'):
+                self.client.post(
+                    '/auth/register',
+                    data=json.dumps(dict(
+                        username=username,
+                        email=f'{username}@meta.com',
+                        password='password'
+                    )),
+                    content_type='application/json'
+                )
+            response = self.client.get('/users/stats')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['data']['total'], 2)
+            self.assertEqual(data['data']['active'], 2)
+            self.assertEqual(data['data']['admin'], 0)
+            self.assertIn('success', data['status'])
+            response = self.client.head('/users')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['X-Total-Count'], '2')
+
+    def test_users_stats_refresh(self):
+        """Ensure users stats can be recomputed from the users table."""
+        add_user('michel', 'michel@meta.com', 'michelmichel')
+        UserCounter.refresh()
+        db.session.commit()
+        with self.client:
+            response = self.client.get('/users/stats')
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['data']['total'], 1)
+            self.assertEqual(sum(
+                day['count'] for day in data['data']['signups']), 1)
+
     def test_add_user_invalid_json_keys_no_password(self):
         """Ensure error is thrown if the JSON object does not have a password key."""
         add_user('test', 'test@test.com', 'test')
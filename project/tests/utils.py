@@ -2,7 +2,10 @@
 
 
 import datetime
+import json
+from contextlib import contextmanager
 
+from sqlalchemy import event
 
 from project import db
 from project.api.models import User
@@ -17,3 +20,50 @@ def add_user(username, email, password, created_at=datetime.datetime.utcnow()):
     db.session.add(user)
     db.session.commit()
     return user
+
+
+def login(client, email='test@test.com', password='test'):
+    """POSTs /auth/login - :return: the response"""
+    return client.post(
+        '/auth/login',
+        data=json.dumps(dict(
+            email=email,
+            password=password
+        )),
+        content_type='application/json'
+    )
+
+
+def auth_token(response):
+    """The token of a login or register response"""
+    return json.loads(response.data.decode())['auth_token']
+
+
+def auth_headers(response):
+    """Authorization header of a login or register response"""
+    return dict(Authorization='Bearer ' + auth_token(response))
+
+
+class FakeClock:
+    """Settable clock for the classes taking a `clock` callable"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@contextmanager
+def count_queries():
+    """Collects the SQL statements run inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(
+            db.engine, 'before_cursor_execute', before_cursor_execute)